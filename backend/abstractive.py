@@ -0,0 +1,54 @@
+# --------------------
+# Abstractive Summarization (BART, token-aware)
+# --------------------
+# Shared by /transcribe_and_summarize and bench/bart.py. Text is cut on
+# sentence boundaries into chunks that fit the model's input window, so no
+# chunk loses its tail to truncation; chunks are summarized in batches and the
+# chunk summaries are reduced level by level into one overall summary.
+import re
+from contextlib import nullcontext
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+def sentence_chunks(text, tokenizer, max_tokens=1000):
+    """Greedy packing of whole sentences into chunks of at most max_tokens tokens."""
+    sentences = [s for s in SENTENCE_RE.split(text.strip()) if s]
+    if not sentences:
+        return []
+    chunks, current, used = [], [], 0
+    for sentence, ids in zip(sentences, tokenizer(sentences, add_special_tokens=False).input_ids):
+        n = len(ids) + 1  # +1 for the joining space
+        if n > max_tokens:
+            # Unpunctuated ASR run-on: cut it into token windows instead
+            if current:
+                chunks.append(" ".join(current))
+                current, used = [], 0
+            chunks.extend(tokenizer.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens))
+            continue
+        if current and used + n > max_tokens:
+            chunks.append(" ".join(current))
+            current, used = [], 0
+        current.append(sentence)
+        used += n
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def summarize_batched(pipe, texts, batch_size=4, stage=nullcontext, **generate_kwargs):
+    """Runs the summarization pipeline batch_size texts at a time; stage() wraps each call."""
+    summaries = []
+    for i in range(0, len(texts), batch_size):
+        with stage():
+            out = pipe(texts[i:i + batch_size], batch_size=batch_size, truncation=True, **generate_kwargs)
+        summaries.extend(o["summary_text"] for o in out)
+    return summaries
+
+def summarize_document(pipe, text, max_tokens=1000, batch_size=4, stage=nullcontext, min_words=50, **generate_kwargs):
+    """Returns (chunk summaries, overall summary); chunks of min_words or fewer are skipped."""
+    chunks = [c for c in sentence_chunks(text, pipe.tokenizer, max_tokens) if len(c.split()) > min_words]
+    summaries = summarize_batched(pipe, chunks, batch_size, stage, **generate_kwargs)
+    level = summaries
+    while len(level) > 1:
+        merged = sentence_chunks(" ".join(level), pipe.tokenizer, max_tokens)
+        level = summarize_batched(pipe, merged, batch_size, stage, **generate_kwargs)
+    return summaries, (level[0] if level else "")
@@ -0,0 +1,63 @@
+# --------------------
+# ANN Index Backends (course-library RAG)
+# --------------------
+# Builders and search parameters shared by the library index in
+# transcribe_api.py and bench/ann.py. Vector ids are insertion positions, so
+# no IDMap layer is needed and id filters map straight onto faiss selectors.
+import faiss
+import numpy as np
+
+BACKENDS = ("flat", "hnsw", "ivfpq")
+
+def pq_subquantizers(d, preferred=48):
+    """Largest divisor of d that does not exceed the preferred PQ code size."""
+    return max(m for m in range(1, min(preferred, d) + 1) if d % m == 0)
+
+def build_index(d, backend, train_vectors, n_expected, nlist=None, pq_m=48, hnsw_m=32, refine=True):
+    """Creates (and trains, where needed) an empty index ready for add().
+
+    ivfpq is wrapped in IndexRefineFlat when refine is set: PQ distances pick
+    k * k_factor candidates and exact distances re-rank them, so recall keeps
+    rising with nprobe instead of stalling at the PQ error.
+    """
+    if backend == "flat":
+        return faiss.IndexFlatL2(d)
+
+    if backend == "hnsw":
+        # 8-bit scalar quantized storage: a quarter of the float32 footprint
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, hnsw_m)
+    elif backend == "ivfpq":
+        # faiss wants roughly 39 training points per list
+        nlist = nlist or int(4 * np.sqrt(max(n_expected, 1)))
+        nlist = max(1, min(nlist, len(train_vectors) // 39))
+        # Each PQ codebook has 2**nbits centroids and needs at least that many training points
+        if len(train_vectors) < 2:
+            raise ValueError(f"ivfpq needs at least 2 training vectors, got {len(train_vectors)}; use flat or hnsw.")
+        nbits = min(8, int(np.log2(len(train_vectors))))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, pq_subquantizers(d, pq_m), nbits)
+        if refine:
+            index = faiss.IndexRefineFlat(index)
+    else:
+        raise ValueError(f"Unknown ANN backend: {backend}")
+
+    index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+    return index
+
+def search_params(index, nprobe=16, ef_search=64, allowed_ids=None, k_factor=4):
+    """Per-query recall/latency knobs plus an optional id filter."""
+    if isinstance(index, faiss.IndexRefine):
+        # The filter and nprobe apply to the PQ candidate search; re-ranking is exact
+        base = search_params(faiss.downcast_index(index.base_index), nprobe, ef_search, allowed_ids)
+        return faiss.IndexRefineSearchParameters(k_factor=k_factor, base_index_params=base)
+    kwargs = {}
+    if allowed_ids is not None:
+        kwargs["sel"] = faiss.IDSelectorBatch(np.ascontiguousarray(allowed_ids, dtype=np.int64))
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe, **kwargs)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search, **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+def search(index, queries, k, params=None):
+    queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+    return index.search(queries, k, params=params)
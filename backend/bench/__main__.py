@@ -0,0 +1,80 @@
+# --------------------
+# Benchmark Suite Runner
+# --------------------
+# Runs each suite in a fresh spawned process (so peak RSS is per suite) and
+# writes one JSON file with the environment and every suite's results.
+# Run from backend/:
+#   python -m bench --suites summarizer,rag,ann --out bench/results/base.json
+#   python -m bench --compare bench/results/base.json bench/results/new.json
+# Suites whose dependencies or cached models are missing are recorded as skipped.
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bench.common import environment, run_suite
+
+# Small, fast defaults; each suite's own CLI exposes the full knobs
+SUITES = {
+    "summarizer": {"sentences": 20000, "repeat": 3},
+    "rag": {"n_facts": 500},
+    "ann": {"n": 20000, "n_queries": 200},
+    "pdf": {"n_facts": 2000},
+    "asr": {"models": ["tiny.en"], "seconds": 60},
+    "llm": {},
+    "bart": {"n_facts": 30},
+}
+
+def run(names):
+    report = {"environment": environment(), "suites": {}}
+    ctx = multiprocessing.get_context("spawn")
+    for name in names:
+        print(f"▶ {name}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                report["suites"][name] = pool.submit(run_suite, name, SUITES[name]).result()
+            except ImportError as e:
+                report["suites"][name] = {"skipped": f"missing dependency: {e}"}
+            except Exception as e:
+                report["suites"][name] = {"skipped": f"{type(e).__name__}: {e}"}
+    return report
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            out.update(flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def compare(old_path, new_path):
+    """Prints every numeric metric present in both runs with its relative change."""
+    with open(old_path) as f:
+        old = flatten(json.load(f)["suites"])
+    with open(new_path) as f:
+        new = flatten(json.load(f)["suites"])
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        change = f"{(b - a) / abs(a) * 100:+.1f}%" if a else "n/a"
+        print(f"{key:<60} {a:>12} -> {b:<12} {change}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--suites", default=",".join(SUITES))
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        report = run([s for s in args.suites.split(",") if s])
+        out = args.out or os.path.join("bench", "results", f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {out}")
@@ -0,0 +1,86 @@
+# --------------------
+# Benchmark: ANN Library Index vs Flat
+# --------------------
+# Recall@k and single-query p50/p99 latency of the HNSW / IVF-PQ backends
+# against exact flat search on clustered synthetic MiniLM-sized vectors.
+# IVF-PQ runs with k_factor 1 (PQ distances only) and with the exact refine
+# stage; only the latter lets nprobe move recall.
+# Run from backend/:
+#   python -m bench.ann --n 100000 --queries 500
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+import ann_index
+
+def clustered_vectors(n, d=384, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, d)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + 0.35 * rng.normal(size=(n, d)).astype(np.float32)
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+def latency_ms(index, queries, k, params):
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        ann_index.search(index, q, k, params)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(times, 50)), float(np.percentile(times, 99))
+
+def run(n=100000, n_queries=500, k=10, filter_share=0.1, seed=0):
+    data = clustered_vectors(n + n_queries, seed=seed)
+    vectors, queries = data[:n], data[n:]
+    d = vectors.shape[1]
+    rng = np.random.default_rng(seed + 1)
+    allowed = np.sort(rng.choice(n, size=int(n * filter_share), replace=False))
+
+    flat = ann_index.build_index(d, "flat", None, n)
+    flat.add(vectors)
+    _, truth = ann_index.search(flat, queries, k)
+    _, truth_filtered = ann_index.search(flat, queries, k, ann_index.search_params(flat, allowed_ids=allowed))
+
+    configs = [("flat", {})]
+    configs += [("hnsw", {"ef_search": ef}) for ef in (16, 64, 128)]
+    configs += [("ivfpq", {"nprobe": p, "k_factor": r}) for r in (1, 4, 16) for p in (4, 16, 64)]
+
+    built, results = {}, []
+    for backend, knobs in configs:
+        if backend not in built:
+            start = time.perf_counter()
+            train = vectors[rng.choice(n, size=min(n, 50000), replace=False)]
+            index = flat if backend == "flat" else ann_index.build_index(d, backend, train, n)
+            if backend != "flat":
+                index.add(vectors)
+            built[backend] = (index, time.perf_counter() - start)
+        index, build_s = built[backend]
+
+        params = ann_index.search_params(index, **knobs)
+        _, found = ann_index.search(index, queries, k, params)
+        _, found_filtered = ann_index.search(index, queries, k, ann_index.search_params(index, allowed_ids=allowed, **knobs))
+        p50, p99 = latency_ms(index, queries, k, params)
+        results.append({
+            "backend": backend,
+            **knobs,
+            f"recall@{k}": round(recall_at_k(found, truth, k), 4),
+            f"filtered_recall@{k}": round(recall_at_k(found_filtered, truth_filtered, k), 4),
+            "p50_ms": round(p50, 3),
+            "p99_ms": round(p99, 3),
+            "build_s": round(build_s, 2),
+            "index_mb": round(len(faiss.serialize_index(index)) / 2**20, 1),
+        })
+    return {"n": n, "queries": n_queries, "k": k, "results": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.n, args.queries, args.k), indent=2))
@@ -0,0 +1,56 @@
+# --------------------
+# Benchmark: ASR (faster-whisper)
+# --------------------
+# Real-time factor, per-file latency and WER for each model. Models must be in
+# the local Hugging Face cache (set HF_HUB_OFFLINE=1 to guarantee no network).
+# Run from backend/:
+#   python -m bench.asr --models tiny.en,small.en
+import argparse
+import json
+import tempfile
+import time
+
+from bench.common import latency_stats, peak_rss_mb, word_error_rate
+from bench.fixtures import SAMPLE_RATE, audio_fixtures
+
+def run(models=("tiny.en",), seconds=60, beam_size=5):
+    from faster_whisper import WhisperModel, decode_audio
+
+    workdir = tempfile.mkdtemp(prefix="bench_asr_")
+    fixtures = [(decode_audio(path, sampling_rate=SAMPLE_RATE), ref) for path, ref in audio_fixtures(workdir, seconds)]
+    audio_seconds = sum(len(a) for a, _ in fixtures) / SAMPLE_RATE
+    results = {"files": len(fixtures), "audio_seconds": round(audio_seconds, 1), "models": {}}
+
+    for name in models:
+        start = time.perf_counter()
+        model = WhisperModel(name, device="cpu", compute_type="int8")
+        load_s = time.perf_counter() - start
+
+        per_file, errors = [], []
+        for audio, ref in fixtures:
+            start = time.perf_counter()
+            segments, _ = model.transcribe(audio, beam_size=beam_size, language="en")
+            text = " ".join(s.text for s in segments)
+            per_file.append(time.perf_counter() - start)
+            if ref:
+                errors.append(word_error_rate(ref, text))
+
+        decode_s = sum(per_file)
+        results["models"][name] = {
+            "load_s": round(load_s, 2),
+            "decode_s": round(decode_s, 2),
+            "rtf": round(decode_s / audio_seconds, 4),
+            "audio_seconds_per_second": round(audio_seconds / decode_s, 2),
+            "wer": round(sum(errors) / len(errors), 4) if errors else None,
+            "latency": latency_stats(per_file),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        del model
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default="tiny.en")
+    parser.add_argument("--seconds", type=float, default=60)
+    args = parser.parse_args()
+    print(json.dumps(run(args.models.split(","), args.seconds), indent=2))
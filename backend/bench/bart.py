@@ -0,0 +1,71 @@
+# --------------------
+# Benchmark: BART Summarization
+# --------------------
+# The original loop (3000-char slices, one pipeline call each) against the
+# token-aware batched path in abstractive.py: wall time, chunks, how many
+# slices overflow the 1024-token window, and ROUGE-1 against the fixture's key
+# sentences. The model must be in the local Hugging Face cache.
+# Run from backend/:
+#   python -m bench.bart --facts 60 --batch-size 4
+import argparse
+import json
+import time
+
+import abstractive
+from bench.common import peak_rss_mb, rouge_n
+from bench.fixtures import lecture_fixture
+
+GENERATE = {"max_length": 150, "min_length": 30, "do_sample": False}
+
+def legacy_summarize(pipe, text):
+    """The original /transcribe_and_summarize loop, kept as the baseline."""
+    summary = []
+    for ch in [text[i:i + 3000] for i in range(0, len(text), 3000)]:
+        if len(ch.split()) > 50:
+            summary.append(pipe(ch, truncation=True, **GENERATE)[0]["summary_text"])
+    return summary
+
+def run(model_id="facebook/bart-large-cnn", n_facts=60, batch_size=4, max_tokens=1000):
+    from transformers import pipeline
+    pipe = pipeline("summarization", model=model_id, device=-1)
+    text, _, reference = lecture_fixture(n_facts)
+    window = pipe.tokenizer.model_max_length
+
+    slices = [text[i:i + 3000] for i in range(0, len(text), 3000)]
+    overflow = sum(len(ids) > window for ids in pipe.tokenizer(slices).input_ids)
+    start = time.perf_counter()
+    legacy = legacy_summarize(pipe, text)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summaries, overall = abstractive.summarize_document(pipe, text, max_tokens, batch_size, **GENERATE)
+    batched_s = time.perf_counter() - start
+
+    return {
+        "model": model_id,
+        "words": len(text.split()),
+        "legacy": {
+            "chunks": len(slices),
+            "truncated_chunks": overflow,
+            "seconds": round(legacy_s, 2),
+            "rouge1": rouge_n(reference, " ".join(legacy), 1),
+        },
+        "batched": {
+            "chunks": len(summaries),
+            "batch_size": batch_size,
+            "seconds": round(batched_s, 2),
+            "rouge1": rouge_n(reference, " ".join(summaries), 1),
+            "overall_rouge1": rouge_n(reference, overall, 1),
+        },
+        "speedup": round(legacy_s / batched_s, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="facebook/bart-large-cnn")
+    parser.add_argument("--facts", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.model, args.facts, args.batch_size, args.max_tokens), indent=2))
@@ -0,0 +1,109 @@
+# --------------------
+# Benchmark Helpers
+# --------------------
+# Timing, memory and quality metrics shared by the bench.* suites.
+import importlib
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+def run_suite(name, kwargs):
+    """Imports bench.<name> and times its run(); the runner calls this in a child process."""
+    module = importlib.import_module(f"bench.{name}")
+    start = time.perf_counter()
+    result = module.run(**kwargs)
+    return {"seconds": round(time.perf_counter() - start, 2), "result": result}
+
+def load_app(**env):
+    """Imports transcribe_api with model warmup off and its caches and indexes in a scratch dir.
+
+    Suites that drive the app's own helpers use this; env overrides its config.
+    The import needs the app's dependencies and the cached Qwen tokenizer.
+    """
+    workdir = tempfile.mkdtemp(prefix="bench_app_")
+    os.environ.update({
+        "MODEL_WARMUP": "",
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "EMBED_CACHE_DIR": os.path.join(workdir, "embeddings"),
+        "RAG_INDEX_DIR": os.path.join(workdir, "indexes"),
+        **{k: str(v) for k, v in env.items()},
+    })
+    return importlib.import_module("transcribe_api")
+
+def latency_stats(seconds):
+    """p50/p95/p99/mean in milliseconds for a list of per-call durations."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "n": int(len(ms)),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+def time_calls(fn, inputs, warmup=1):
+    """Calls fn on every input; returns (per-call seconds, outputs)."""
+    for x in inputs[:warmup]:
+        fn(x)
+    seconds, outputs = [], []
+    for x in inputs:
+        start = time.perf_counter()
+        outputs.append(fn(x))
+        seconds.append(time.perf_counter() - start)
+    return seconds, outputs
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def words(text):
+    return text.lower().split()
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref, hyp = words(reference), words(hypothesis)
+    prev = np.arange(len(hyp) + 1)
+    for i, r in enumerate(ref, 1):
+        cur = np.empty_like(prev)
+        cur[0] = i
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return float(prev[-1]) / max(len(ref), 1)
+
+def rouge_n(reference, summary, n=1):
+    """ROUGE-N F1 over lowercased whitespace tokens."""
+    def grams(tokens):
+        return {}.fromkeys(zip(*(tokens[i:] for i in range(n))), 0)
+    ref, hyp = words(reference), words(summary)
+    ref_counts, hyp_counts = grams(ref), grams(hyp)
+    for g in zip(*(ref[i:] for i in range(n))):
+        ref_counts[g] += 1
+    for g in zip(*(hyp[i:] for i in range(n))):
+        hyp_counts[g] += 1
+    overlap = sum(min(c, hyp_counts.get(g, 0)) for g, c in ref_counts.items())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(hyp_counts.values())
+    recall = overlap / sum(ref_counts.values())
+    return round(2 * precision * recall / (precision + recall), 4)
@@ -0,0 +1,90 @@
+# --------------------
+# Benchmark Fixtures
+# --------------------
+# Deterministic, offline inputs: lecture-like text with planted facts (for
+# RAG recall and summary ROUGE), PDFs rendered from that text, and audio from
+# BENCH_AUDIO_DIR (<name>.wav + <name>.txt) or espeak-ng when installed.
+import glob
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+QUANTITIES = ["boiling point", "half life", "activation energy", "learning rate", "tensile strength",
+              "refractive index", "clock speed", "decay constant", "yield ratio", "error margin"]
+ENTITIES = ["compound", "module", "sample", "reactor", "circuit", "specimen", "network", "lattice"]
+FILLER = (
+    "so as we discussed earlier the main idea here is that we can look at this from another angle "
+    "and if you remember the previous lecture we saw how the structure changes when conditions shift "
+    "this is important because it shows up again in the exam and in practice when you work with real "
+    "systems the details matter a lot and you should keep in mind the assumptions we made at the start"
+).split()
+
+SAMPLE_RATE = 16000
+
+def lecture_fixture(n_facts=200, filler_sentences=6, seed=0):
+    """Returns (text, facts, reference_summary); facts are (question, answer) pairs."""
+    rng = np.random.default_rng(seed)
+    sentences, facts, key_sentences = [], [], []
+    for i in range(n_facts):
+        quantity = QUANTITIES[i % len(QUANTITIES)]
+        entity = f"{ENTITIES[(i // len(QUANTITIES)) % len(ENTITIES)]} {i}"
+        value = f"{rng.uniform(1, 99):.2f}"
+        fact = f"The {quantity} of {entity} is {value}."
+        key_sentences.append(fact)
+        facts.append((f"What is the {quantity} of {entity}?", value))
+        sentences.append(fact)
+        for _ in range(filler_sentences):
+            n = int(rng.integers(10, 25))
+            sentences.append(" ".join(rng.choice(FILLER, size=n)).capitalize() + ".")
+    return " ".join(sentences), facts, " ".join(key_sentences)
+
+def write_pdf(path, text, chars_per_page=2500):
+    """Renders text onto as many A4 pages as needed (requires PyMuPDF)."""
+    import fitz
+    doc = fitz.open()
+    for i in range(0, len(text), chars_per_page):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 555, 800), text[i:i + chars_per_page], fontsize=8)
+    doc.save(path)
+    doc.close()
+    return path
+
+def audio_fixtures(workdir, seconds=60):
+    """(audio_path, reference_text or None) pairs, best source first."""
+    bundled = os.getenv("BENCH_AUDIO_DIR")
+    if bundled:
+        pairs = []
+        for path in sorted(glob.glob(os.path.join(bundled, "*.wav"))):
+            ref = os.path.splitext(path)[0] + ".txt"
+            pairs.append((path, open(ref).read() if os.path.exists(ref) else None))
+        if pairs:
+            return pairs
+
+    os.makedirs(workdir, exist_ok=True)
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    if espeak:
+        # ~150 words per minute of speech
+        text, _, _ = lecture_fixture(n_facts=max(1, int(seconds / 20)), filler_sentences=3)
+        text = " ".join(text.split()[: int(seconds * 2.5)])
+        path = os.path.join(workdir, "speech.wav")
+        subprocess.run([espeak, "-w", path, text], check=True, capture_output=True)
+        return [(path, text)]
+
+    # Last resort: tone bursts measure throughput only, WER is not reported
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.3 * np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0)
+    path = os.path.join(workdir, "tones.wav")
+    write_wav(path, audio)
+    return [(path, None)]
+
+def write_wav(path, audio, sample_rate=SAMPLE_RATE):
+    import wave
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return path
@@ -0,0 +1,150 @@
+# --------------------
+# Benchmark: LLM Prefill / Decode
+# --------------------
+# Drives the app's own LLM path with a stand-in model registered under "llm":
+# prefill() on top of the prefix KV cache (cold, shared-prefix and repeated
+# prompts), LLMBatcher at several concurrency levels (the LLM_MAX_BATCH
+# trade-off) and generate_direct() per assist mode (LLM_ASSIST). Changes to
+# the batcher, the prefix cache or the direct path move these numbers.
+# The default stand-in is a randomly initialised tiny Qwen2 built from a
+# config over the app's tokenizer, so only the tokenizer must be cached; pass
+# --model to measure a cached checkpoint such as Qwen/Qwen2.5-1.5B-Instruct
+# (and --draft-model for the draft mode). Acceptance on the random stand-in
+# says nothing about real text.
+# Run from backend/:
+#   python -m bench.llm --prompt-tokens 256,1024 --batches 1,4,8
+import argparse
+import json
+import time
+from concurrent.futures import wait
+
+import torch
+
+from bench.common import latency_stats, load_app, peak_rss_mb
+from bench.fixtures import lecture_fixture
+
+def load_model(model_id=None, vocab_size=32000, seed=0):
+    from transformers import AutoModelForCausalLM, Qwen2Config, Qwen2ForCausalLM
+    torch.manual_seed(seed)
+    if model_id:
+        return AutoModelForCausalLM.from_pretrained(model_id, dtype=torch.float32).eval()
+    config = Qwen2Config(
+        vocab_size=vocab_size, hidden_size=256, intermediate_size=704, num_hidden_layers=4,
+        num_attention_heads=8, num_key_value_heads=2, max_position_embeddings=8192,
+    )
+    return Qwen2ForCausalLM(config).eval()
+
+def messages(context, question="Summarize the key points."):
+    """A notes/RAG-shaped chat: fixed rules, a long shared context, a short question."""
+    return [
+        {"role": "system", "content": "You are a helpful Academic Assistant. Use ONLY the provided lecture context."},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion:\n{question}"},
+    ]
+
+def contexts(n_tokens, count):
+    """count distinct lecture passages of about n_tokens tokens each."""
+    words = lecture_fixture(max(20, n_tokens * count // 40))[0].split()
+    size = int(n_tokens / 1.3)
+    return [" ".join(words[i * size:(i + 1) * size]) for i in range(count)]
+
+def prompt_ids(app, msgs):
+    text = app.tokenizer.apply_chat_template(msgs, tokenize=False, add_generation_prompt=True)
+    return app.tokenizer(text, return_tensors="pt").input_ids
+
+@torch.no_grad()
+def prefill_ms(app, model, ids):
+    start = time.perf_counter()
+    app.prefill(model, ids, ids.shape[-1] - 1)
+    return (time.perf_counter() - start) * 1000
+
+def run(model_id=None, prompt_tokens=(256, 1024), batches=(1, 2, 4, 8), new_tokens=32, repeat=3,
+        draft_model_id=None, ngram_tokens=10):
+    app = load_app(LLM_BATCHING=1, LLM_MAX_BATCH=max(batches), LLM_ASSIST_NGRAM_TOKENS=ngram_tokens)
+    model = load_model(model_id, len(app.tokenizer))
+    app.model_manager.register("llm", lambda: (model, None), 0)
+    if draft_model_id:
+        draft = load_model(draft_model_id)
+        app.model_manager.register("llm_draft", lambda: (draft, None), 0)
+    results = {"model": model_id or "tiny-random-qwen2", "prefill": {}, "prefix_reuse": {}, "batcher": {}, "assisted": {}}
+
+    for n in prompt_tokens:
+        # Distinct contexts: every prefill is a cache miss past the system prompt
+        passages = contexts(n, repeat + 1)
+        ids = [prompt_ids(app, messages(p)) for p in passages]
+        times = [prefill_ms(app, model, i) for i in ids[:repeat]]
+        results["prefill"][n] = {
+            "prompt_tokens": int(ids[0].shape[-1]),
+            "tokens_per_second": round(ids[0].shape[-1] / (min(times) / 1000), 1),
+            "latency": latency_stats([t / 1000 for t in times]),
+        }
+
+        # Same context, new question (shared prefix); then the same prompt again
+        first = prompt_ids(app, messages(passages[-1], "What is the main idea?"))
+        follow_up = prompt_ids(app, messages(passages[-1], "Which values were measured?"))
+        cold = prefill_ms(app, model, first)
+        reused_before = app.prefix_cache.metrics["reused_tokens"]
+        shared = prefill_ms(app, model, follow_up)
+        repeated = prefill_ms(app, model, first)
+        results["prefix_reuse"][n] = {
+            "cold_ms": round(cold, 2),
+            "shared_prefix_ms": round(shared, 2),
+            "repeat_ms": round(repeated, 2),
+            "reused_tokens": app.prefix_cache.metrics["reused_tokens"] - reused_before,
+            "speedup": round(cold / max(shared, 1e-6), 2),
+        }
+    results["prefix_cache"] = app.prefix_cache.stats()
+
+    # Concurrent requests through the batcher (one request takes the direct path)
+    passage = contexts(prompt_tokens[0], 1)[0]
+    for b in batches:
+        times, produced = [], 0
+        for r in range(repeat):
+            start = time.perf_counter()
+            futures = [app.llm_batcher.submit(messages(passage, f"Question {r}.{i}?"), new_tokens, 0.7) for i in range(b)]
+            wait(futures)
+            times.append(time.perf_counter() - start)
+            produced = sum(len(app.tokenizer(f.result()).input_ids) for f in futures)
+        best = min(times)
+        results["batcher"][b] = {
+            "rows": b,
+            "tokens_per_second": round(produced / best, 1),
+            "request_latency_ms": round(best * 1000, 1),
+        }
+    results["batcher_stats"] = dict(app.llm_batcher.stats)
+
+    # Copy-heavy prompt: the same passage twice, as notes restate their transcript
+    copy_msgs = messages(f"{passage}\n\n{passage}", "Repeat the passage.")
+    modes = ["off", "ngram"] + (["draft"] if draft_model_id else [])
+    for mode in modes:
+        for _ in range(repeat):
+            app.generate_direct(copy_msgs, new_tokens, 0.7, assist=mode)
+    observed = app.assist_stats.describe()
+    base = observed["off"]["tokens_per_second"]
+    for mode in modes:
+        m = observed[mode]
+        results["assisted"][mode] = {
+            "tokens_per_second": m["tokens_per_second"],
+            "acceptance_rate": m["acceptance_rate"],
+            "speedup": round(m["tokens_per_second"] / base, 2) if base and m["tokens_per_second"] else None,
+        }
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--prompt-tokens", default="256,1024")
+    parser.add_argument("--batches", default="1,2,4,8")
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--draft-model", default=None)
+    parser.add_argument("--ngram-tokens", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(
+        args.model,
+        [int(x) for x in args.prompt_tokens.split(",")],
+        [int(x) for x in args.batches.split(",")],
+        args.new_tokens,
+        draft_model_id=args.draft_model,
+        ngram_tokens=args.ngram_tokens,
+    ), indent=2))
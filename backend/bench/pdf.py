@@ -0,0 +1,58 @@
+# --------------------
+# Benchmark: PDF Extraction
+# --------------------
+# Pages/sec of single-process extraction vs the spawned pool used by
+# /pdf_summarize, on a PDF rendered from the lecture fixture.
+# Run from backend/:
+#   python -m bench.pdf --facts 2000 --workers 4
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pdf_worker
+from bench.common import peak_rss_mb
+from bench.fixtures import lecture_fixture, write_pdf
+
+def run(n_facts=2000, workers=4):
+    import fitz
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_pdf_"), "lecture.pdf")
+    text, _, _ = lecture_fixture(n_facts)
+    write_pdf(path, text)
+    with fitz.open(path) as doc:
+        pages = doc.page_count
+
+    start = time.perf_counter()
+    sequential = pdf_worker.extract_pages(path, 0, pages)
+    sequential_s = time.perf_counter() - start
+
+    step = max(1, -(-pages // (workers * 4)))
+    starts = list(range(0, pages, step))
+    ends = [min(s + step, pages) for s in starts]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # First map pays for process spawn; the second is the steady state the API sees
+        list(pool.map(pdf_worker.extract_pages, itertools.repeat(path, len(starts)), starts, ends))
+        start = time.perf_counter()
+        parallel = [p for chunk in pool.map(pdf_worker.extract_pages, itertools.repeat(path, len(starts)), starts, ends) for p in chunk]
+        parallel_s = time.perf_counter() - start
+
+    return {
+        "pages": pages,
+        "sequential_pages_per_second": round(pages / sequential_s, 1),
+        "parallel_pages_per_second": round(pages / parallel_s, 1),
+        "workers": workers,
+        "speedup": round(sequential_s / parallel_s, 2),
+        "identical_text": parallel == sequential,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facts", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run(args.facts, args.workers), indent=2))
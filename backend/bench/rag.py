@@ -0,0 +1,106 @@
+# --------------------
+# Benchmark: RAG Retrieval
+# --------------------
+# Drives the app's own LectureDoubtSolver: its splitter and index registry
+# ingest the fixture, then every planted question goes through dense search,
+# retrieve() (dense + BM25 fused) and build_context(), the token-budgeted
+# context ask_doubt sends. Reports recall@k, embedding throughput, query
+# latency and context size, so changes to any of those helpers move a number.
+# --embedder hash swaps the app's MiniLM for a dependency-free stand-in
+# (hashed, log-scaled bag of words); --embedder minilm keeps the real one.
+# Run from backend/:
+#   python -m bench.rag --facts 500 --embedder hash
+import argparse
+import json
+import re
+import time
+import zlib
+
+import numpy as np
+
+from bench.common import latency_stats, load_app, peak_rss_mb, time_calls
+from bench.fixtures import lecture_fixture
+
+TOKEN_RE = re.compile(r"\w+")
+LECTURE_ID = "bench_lecture"
+
+class HashEmbeddings:
+    """Stand-in for the embedding model behind EmbeddingService."""
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for w in TOKEN_RE.findall(t.lower()):
+                out[i, zlib.crc32(w.encode()) % self.dim] += 1.0
+        # Sublinear counts keep repeated filler words from swamping rare terms
+        out = np.log1p(out)
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def run(n_facts=500, k=3, embedder="hash", candidates=20, context_tokens=384):
+    app = load_app(RAG_CANDIDATES=candidates, RAG_CONTEXT_TOKENS=context_tokens, RAG_RERANKER="")
+    solver = app.rag_solver
+    if embedder == "hash":
+        solver.embeddings.inner = HashEmbeddings()
+        solver.embeddings.tag = "bench-hash"
+    text, facts, _ = lecture_fixture(n_facts)
+
+    start = time.perf_counter()
+    solver.process_lecture_data(text, LECTURE_ID)
+    ingest_s = time.perf_counter() - start
+    store = solver.registry.get(LECTURE_ID).store
+    n_chunks = store.index.ntotal
+
+    def dense(q):
+        return [d for d, _ in store.similarity_search_with_score_by_vector(solver.embeddings.embed_query(q), k=k)]
+
+    def hybrid(q):
+        return solver.retrieve(q, [LECTURE_ID])
+
+    def context(q):
+        return solver.build_context(q, LECTURE_ID) or ""
+
+    def recall(hits):
+        return round(sum(any(answer in d.page_content for d in docs) for (_, answer), docs in zip(facts, hits)) / len(facts), 4)
+
+    questions = [q for q, _ in facts]
+    dense_s, dense_hits = time_calls(dense, questions)
+    hybrid_s, hybrid_hits = time_calls(hybrid, questions)
+    context_s, contexts = time_calls(context, questions)
+
+    # What ask_doubt used to send (k stuffed chunks) against the packed budget now
+    stuffed = [app.count_tokens("\n\n".join(d.page_content for d in docs)) for docs in dense_hits]
+    packed = [app.count_tokens(c) for c in contexts]
+    return {
+        "embedder": embedder,
+        "chunks": n_chunks,
+        "ingest_seconds": round(ingest_s, 2),
+        "embed_chunks_per_second": solver.embeddings.describe()["chunks_per_second"],
+        "dense": {f"recall@{k}": recall(dense_hits), "query": latency_stats(dense_s)},
+        "hybrid": {
+            f"recall@{k}": recall([docs[:k] for docs in hybrid_hits]),
+            "query": latency_stats(hybrid_s),
+        },
+        "context": {
+            "stuffed_tokens_mean": round(float(np.mean(stuffed)), 1),
+            "packed_tokens_mean": round(float(np.mean(packed)), 1),
+            "packed_recall": round(sum(answer in c for (_, answer), c in zip(facts, contexts)) / len(facts), 4),
+            "build": latency_stats(context_s),
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facts", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--embedder", choices=["hash", "minilm"], default="hash")
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--context-tokens", type=int, default=384)
+    args = parser.parse_args()
+    print(json.dumps(run(args.facts, args.k, args.embedder, args.candidates, args.context_tokens), indent=2))
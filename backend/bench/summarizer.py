@@ -0,0 +1,110 @@
+# --------------------
+# Benchmark: Extractive Summarizer
+# --------------------
+# Compares extractive.accurate_35_summarize against the original per-sentence
+# implementation on synthetic text. Run from backend/:
+#   python -m bench.summarizer --sentences 20000
+import argparse
+import re
+import time
+from collections import Counter
+
+import numpy as np
+
+from extractive import accurate_35_summarize
+from bench.common import peak_rss_mb, rouge_n
+from bench.fixtures import lecture_fixture
+
+def legacy_35_summarize(text, target_ratio=0.35):
+    """The original implementation, kept verbatim as the baseline."""
+    text = re.sub(r'\s+', ' ', text)
+    sentences = re.split(r'(?<=[\.!?])\s+', text)
+    sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
+
+    unique_sentences = []
+    seen = set()
+    for sent in sentences:
+        h = hash(sent.lower())
+        if h not in seen:
+            unique_sentences.append(sent)
+            seen.add(h)
+    sentences = unique_sentences
+
+    orig_words = len(re.findall(r'\b\w+\b', text))
+    target_words = max(500, int(orig_words * target_ratio))
+
+    all_words = re.findall(r'\b\w+\b', text.lower())
+    word_freq = Counter(all_words)
+
+    scored_sentences = []
+    for sent in sentences:
+        sent_words = re.findall(r'\b\w+\b', sent.lower())
+        score = sum(word_freq[w] * np.log(len(all_words) / word_freq[w])
+                   for w in sent_words if word_freq[w] > 1)
+        word_count = len(sent_words)
+        scored_sentences.append((score, word_count, sent))
+
+    scored_sentences.sort(key=lambda x: x[0], reverse=True)
+    selected_sentences = []
+    current_word_count = 0
+
+    for score, word_count, sent in scored_sentences:
+        if current_word_count + word_count <= target_words:
+            selected_sentences.append(sent)
+            current_word_count += word_count
+        if current_word_count >= target_words * 0.9:
+            break
+
+    order_map = {sent: i for i, sent in enumerate(sentences)}
+    selected_sentences.sort(key=lambda x: order_map[x])
+    return "\n\n".join(selected_sentences), orig_words, current_word_count
+
+def synthetic_text(n_sentences, vocab_size=5000, seed=0):
+    """Zipf-distributed words in sentences of 8-30 words."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"term{i}" for i in range(vocab_size)])
+    ranks = np.minimum(rng.zipf(1.3, size=n_sentences * 30), vocab_size) - 1
+    lengths = rng.integers(8, 31, size=n_sentences)
+    out, pos = [], 0
+    for n in lengths:
+        words = vocab[ranks[pos:pos + n]]
+        pos += n
+        out.append(" ".join(words).capitalize() + ".")
+    return " ".join(out)
+
+def timed(fn, *args, repeat=3, **kwargs):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def run(sentences=20000, repeat=3):
+    text = synthetic_text(sentences)
+    results = {"sentences": sentences, "chars": len(text)}
+    legacy_s, legacy = timed(legacy_35_summarize, text, repeat=repeat)
+    results["legacy_s"] = round(legacy_s, 4)
+    for method in ("tfidf", "textrank"):
+        seconds, out = timed(accurate_35_summarize, text, method=method, repeat=repeat)
+        results[f"{method}_s"] = round(seconds, 4)
+        if method == "tfidf":
+            results["tfidf_matches_legacy"] = out == legacy
+    results["tfidf_speedup"] = round(legacy_s / results["tfidf_s"], 2)
+
+    # Quality: the planted fact sentences act as the reference summary
+    lecture, _, reference = lecture_fixture()
+    for method in ("tfidf", "textrank"):
+        summary, _, _ = accurate_35_summarize(lecture, method=method)
+        results[f"{method}_rouge1"] = rouge_n(reference, summary, 1)
+        results[f"{method}_rouge2"] = rouge_n(reference, summary, 2)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for key, value in run(args.sentences, args.repeat).items():
+        print(f"{key:>22}: {value}")
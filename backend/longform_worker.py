@@ -0,0 +1,24 @@
+# --------------------
+# Long-Form Transcription Worker
+# --------------------
+# Runs inside spawned pool processes. Kept apart from transcribe_api.py so a
+# worker only loads its own Whisper model, not the whole API and its LLMs.
+import os
+
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+from faster_whisper import WhisperModel
+
+worker_model = None
+
+def init_worker(model_name, cpu_threads):
+    global worker_model
+    worker_model = WhisperModel(model_name, device="cpu", compute_type="int8", cpu_threads=cpu_threads)
+
+def transcribe_span(audio, offset, beam_size=5, language="en"):
+    """Transcribes one speech span and shifts its timestamps to absolute time."""
+    segments, _ = worker_model.transcribe(audio, beam_size=beam_size, language=language)
+    return [
+        {"start": offset + s.start, "end": offset + s.end, "text": s.text}
+        for s in segments
+    ]
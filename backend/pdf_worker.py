@@ -0,0 +1,10 @@
+# --------------------
+# PDF Extraction Worker
+# --------------------
+# Runs inside spawned pool processes, one contiguous page range per task.
+import fitz  # PyMuPDF
+
+def extract_pages(path, start, end):
+    """Returns [(page_number, text), ...] for pages start..end-1, one get_text() each."""
+    with fitz.open(path) as doc:
+        return [(i + 1, doc[i].get_text()) for i in range(start, end)]
@@ -0,0 +1,113 @@
+# --------------------
+# Hybrid Retrieval (BM25 + dense fusion, context packing)
+# --------------------
+# Pure helpers shared by the doubt solver in transcribe_api.py and bench/rag.py:
+#   BM25Index       in-memory sparse index over a lecture's chunks
+#   fuse            reciprocal rank fusion of several ranked key lists
+#   pack            fits the best passages into a token budget, in reading
+#                   order, gluing the splitter's overlapping chunk edges
+import re
+from collections import defaultdict
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+")
+RRF_K = 60
+
+def terms(text):
+    return TOKEN_RE.findall(text.lower())
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of texts; positions index into that list."""
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1, self.b = k1, b
+        self.n = len(texts)
+        postings = defaultdict(dict)
+        lengths = np.zeros(self.n, dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = terms(text)
+            lengths[i] = len(words)
+            for w in words:
+                postings[w][i] = postings[w].get(i, 0) + 1
+        self.lengths = lengths
+        self.avg_length = float(lengths.mean()) if self.n else 0.0
+        self.postings = {
+            w: (np.fromiter(p.keys(), dtype=np.int64, count=len(p)), np.fromiter(p.values(), dtype=np.float32, count=len(p)))
+            for w, p in postings.items()
+        }
+
+    def idf(self, df):
+        return np.log1p((self.n - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=20):
+        """Returns up to k (position, score) pairs, best first; chunks sharing no term are left out."""
+        if not self.n:
+            return []
+        scores = np.zeros(self.n, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / max(self.avg_length, 1e-9))
+        for w in set(terms(query)):
+            if w not in self.postings:
+                continue
+            ids, tf = self.postings[w]
+            scores[ids] += self.idf(len(ids)) * tf * (self.k1 + 1) / (tf + norm[ids])
+        hits = np.flatnonzero(scores)
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(int(i), float(scores[i])) for i in top]
+
+def fuse(rankings, k=RRF_K):
+    """Reciprocal rank fusion: each list contributes 1 / (k + rank) per key."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda key: -scores[key])
+
+def overlap(a, b, max_chars=300, min_chars=20):
+    """Length of the longest suffix of a that is also a prefix of b (0 if under min_chars)."""
+    for n in range(min(len(a), len(b), max_chars), min_chars - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+def render(passages):
+    """Joins (order, text) pairs in reading order, merging consecutive chunks whose edges overlap.
+
+    Only a chunk whose position directly follows the previous one in the same
+    group is glued on; chunks further apart stay separate even if they happen
+    to share an edge.
+    """
+    out = []
+    for order, text in sorted(passages, key=lambda p: p[0]):
+        if out and out[-1][0][0] == order[0]:
+            prev = out[-1][1]
+            if text in prev:
+                continue
+            n = overlap(prev, text) if order[1] == out[-1][0][1] + 1 else 0
+            if n:
+                out[-1] = (order, prev + text[n:])
+                continue
+        out.append((order, text))
+    return "\n\n".join(text for _, text in out)
+
+def pack(passages, budget, count_tokens, max_passages=None):
+    """Greedily adds (order, text) passages, best first, while the rendered context fits budget tokens.
+
+    order is a (group, integer position) tuple; only passages at consecutive
+    positions of the same group are merged. Returns (context text, number of passages used, token count).
+    """
+    chosen, text, tokens = [], "", 0
+    for passage in passages:
+        if max_passages and len(chosen) >= max_passages:
+            break
+        candidate = render(chosen + [passage])
+        n = count_tokens(candidate)
+        if n <= budget:
+            chosen.append(passage)
+            text, tokens = candidate, n
+    if not chosen and passages:
+        # Always answer from something: the best passage, cut to the budget
+        best = passages[0][1]
+        while best and count_tokens(best) > budget:
+            best = best[:int(len(best) * 0.9)]
+        chosen, text, tokens = [passages[0]], best, count_tokens(best)
+    return text, len(chosen), tokens
@@ -0,0 +1,230 @@
+# --------------------
+# Structured Decoding (quiz JSON, Graphviz DOT)
+# --------------------
+# A grammar is a generator "program" that yields steps and receives results:
+#   lit(text)       forced text, prefilled without sampling
+#   field(n)        a quoted string value of at most n tokens, returns the text
+#   choice(a, b..)  one of several literals, picked by the model, returns its index
+# Fields may only sample tokens that are legal inside a JSON/DOT string, so the
+# output is well-formed by construction and decoding ends with the grammar.
+import re
+import torch
+
+UNSAFE_RE = re.compile(r'["\\\x00-\x1f�]')
+
+def lit(text):
+    return ("lit", text)
+
+def field(max_tokens):
+    return ("field", max_tokens)
+
+def choice(*options):
+    return ("choice", options)
+
+class StructuredDecoder:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        quote = tokenizer.encode('"', add_special_tokens=False)
+        if len(quote) != 1:
+            raise ValueError("Tokenizer has no single-token double quote.")
+        self.quote_id = quote[0]
+        self.masks = {}
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def field_masks(self, vocab_size, device):
+        """(string body, string body or closing quote) masks, built once per device."""
+        key = (vocab_size, str(device))
+        if key not in self.masks:
+            # Added/special tokens sit above the base vocabulary and are never allowed
+            base = min(self.tokenizer.vocab_size, vocab_size)
+            texts = self.tokenizer.batch_decode([[i] for i in range(base)])
+            body = torch.zeros(vocab_size, dtype=torch.bool)
+            body[:base] = torch.tensor([bool(t) and not UNSAFE_RE.search(t) for t in texts])
+            closing = body.clone()
+            closing[self.quote_id] = True
+            self.masks[key] = (body.to(device), closing.to(device))
+        return self.masks[key]
+
+    @staticmethod
+    def sample(logits, allowed, temperature):
+        logits = logits.float().masked_fill(~allowed, float("-inf"))
+        if temperature <= 0:
+            return int(logits.argmax())
+        return int(torch.multinomial(torch.softmax(logits / temperature, dim=-1), 1))
+
+    def run(self, model, prompt_ids, program, temperature=0.3, streamer=None, cancel=None, past=None):
+        """Drives the program over the model; returns its result, or None when cancelled.
+
+        past may hold the KV cache of a prefix of prompt_ids; only the rest is prefilled.
+        """
+        state = {"cache": past, "logits": None}
+        start = past.get_seq_length() if past is not None else 0
+
+        def feed(ids, stream=True):
+            ids = torch.as_tensor(ids, device=model.device).reshape(1, -1)
+            # Prompts and multi-token literals only need the last position's logits
+            out = model(input_ids=ids, past_key_values=state["cache"], use_cache=True, logits_to_keep=1)
+            state["cache"], state["logits"] = out.past_key_values, out.logits[0, -1]
+            if streamer is not None and stream:
+                streamer.put(ids.cpu())
+
+        if streamer is not None:
+            streamer.put(prompt_ids.cpu())
+        feed(prompt_ids[:, start:], stream=False)
+        body, closing = self.field_masks(state["logits"].shape[-1], state["logits"].device)
+
+        reply = None
+        try:
+            while True:
+                kind, arg = program.send(reply)
+                if cancel is not None and cancel.is_set():
+                    return None
+                if kind == "lit":
+                    feed(self.encode(arg))
+                    reply = None
+                elif kind == "field":
+                    ids = []
+                    for step in range(arg):
+                        token = self.sample(state["logits"], body if step == 0 else closing, temperature)
+                        if token == self.quote_id:
+                            break
+                        feed([token])
+                        ids.append(token)
+                    reply = self.tokenizer.decode(ids)
+                else:
+                    encoded = [self.encode(o) for o in arg]
+                    firsts = [e[0] for e in encoded]
+                    if len(set(firsts)) != len(firsts):
+                        raise ValueError(f"Choice options share a first token: {arg}")
+                    allowed = torch.zeros_like(body)
+                    allowed[firsts] = True
+                    reply = firsts.index(self.sample(state["logits"], allowed, temperature))
+                    feed(encoded[reply])
+        except StopIteration as done:
+            return done.value
+        finally:
+            if streamer is not None:
+                streamer.end()
+
+    def run_batch(self, model, prompts, programs, temperature=0.3, cancel=None, pad_id=0):
+        """Drives several programs in lockstep over one left-padded batch; returns their results.
+
+        Every forward feeds one token per row: the next token of a pending literal
+        or a sampled one. Rows that finish early are masked out. Returns a list of
+        None when cancelled.
+        """
+        n, width = len(prompts), max(len(p) for p in prompts)
+        ids = torch.full((n, width), pad_id, dtype=torch.long)
+        mask = torch.zeros((n, width), dtype=torch.long)
+        for i, p in enumerate(prompts):
+            ids[i, width - len(p):] = torch.as_tensor(p)
+            mask[i, width - len(p):] = 1
+        ids, mask = ids.to(model.device), mask.to(model.device)
+        out = model(
+            input_ids=ids, attention_mask=mask, position_ids=(mask.cumsum(-1) - 1).clamp(min=0),
+            use_cache=True, logits_to_keep=1,
+        )
+        cache, logits = out.past_key_values, out.logits[:, -1]
+        body, closing = self.field_masks(logits.shape[-1], logits.device)
+        rows = [{"program": p, "pending": [], "field": None, "reply": None, "result": None} for p in programs]
+
+        def next_token(i):
+            """The token row i feeds next, advancing its program as needed; None once it is done."""
+            row = rows[i]
+            while True:
+                if row["pending"]:
+                    return row["pending"].pop(0)
+                if row["field"] is not None:
+                    limit, taken = row["field"]
+                    if len(taken) < limit:
+                        token = self.sample(logits[i], closing if taken else body, temperature)
+                        if token != self.quote_id:
+                            taken.append(token)
+                            return token
+                    row["field"], row["reply"] = None, self.tokenizer.decode(taken)
+                try:
+                    kind, arg = row["program"].send(row["reply"])
+                except StopIteration as done:
+                    row["result"] = done.value
+                    return None
+                row["reply"] = None
+                if kind == "lit":
+                    row["pending"] = self.encode(arg)
+                elif kind == "field":
+                    row["field"] = (arg, [])
+                else:
+                    encoded = [self.encode(o) for o in arg]
+                    firsts = [e[0] for e in encoded]
+                    if len(set(firsts)) != len(firsts):
+                        raise ValueError(f"Choice options share a first token: {arg}")
+                    allowed = torch.zeros_like(body)
+                    allowed[firsts] = True
+                    row["reply"] = firsts.index(self.sample(logits[i], allowed, temperature))
+                    row["pending"] = list(encoded[row["reply"]])
+
+        tokens = [next_token(i) for i in range(n)]
+        while any(t is not None for t in tokens):
+            if cancel is not None and cancel.is_set():
+                return [None] * n
+            live = torch.tensor([[t is not None] for t in tokens], dtype=torch.long, device=model.device)
+            step = torch.tensor([[pad_id if t is None else t] for t in tokens], device=model.device)
+            mask = torch.cat([mask, live], dim=-1)
+            out = model(
+                input_ids=step, attention_mask=mask, position_ids=mask.sum(-1, keepdim=True) - 1,
+                past_key_values=cache, use_cache=True,
+            )
+            cache, logits = out.past_key_values, out.logits[:, -1]
+            tokens = [None if t is None else next_token(i) for i, t in enumerate(tokens)]
+        return [row["result"] for row in rows]
+
+# --------------------
+# Grammars
+# --------------------
+def quiz_program(num_questions, num_distractors=3):
+    """The /generate_quiz JSON list; returns the parsed questions."""
+    quiz = []
+    yield lit("[")
+    for n in range(num_questions):
+        q = {}
+        yield lit(("" if n == 0 else ", ") + '{"question": "')
+        q["question"] = yield field(96)
+        yield lit('", "correct_answer": "')
+        q["correct_answer"] = yield field(48)
+        yield lit('", "distractors": ["')
+        q["distractors"] = []
+        for d in range(num_distractors):
+            if d:
+                yield lit('", "')
+            q["distractors"].append((yield field(48)))
+        yield lit('"], "explanation": "')
+        q["explanation"] = yield field(96)
+        yield lit('"}')
+        quiz.append(q)
+    yield lit("]")
+    return quiz
+
+def dot_program(header, min_edges=3, max_edges=16):
+    """A digraph of labelled edges under the given header; returns the DOT source."""
+    lines = [header]
+    yield lit(header)
+    edges = 0
+    while True:
+        if edges >= max_edges:
+            break
+        if edges >= min_edges:
+            if (yield choice('    "', "}")) == 1:
+                return "".join(lines) + "}"
+        else:
+            yield lit('    "')
+        src = yield field(12)
+        yield lit('" -> "')
+        dst = yield field(12)
+        yield lit('" [label="')
+        label = yield field(8)
+        yield lit('"];\n')
+        lines.append(f'    "{src}" -> "{dst}" [label="{label}"];\n')
+        edges += 1
+    yield lit("}")
+    return "".join(lines) + "}"
@@ -0,0 +1,46 @@
+# --------------------
+# Tests: retrieval helpers
+# --------------------
+# Run from backend/:
+#   python -m pytest -q tests
+from retrieval import BM25Index, fuse, pack, render
+
+EDGE = "the derivative of the position function gives velocity"
+
+def words(text):
+    return len(text.split())
+
+def test_render_glues_consecutive_overlapping_chunks():
+    first = f"Chapter one opens the topic. {EDGE}"
+    second = f"{EDGE} and acceleration follows."
+    assert render([(("a", 2), second), (("a", 1), first)]) == f"Chapter one opens the topic. {EDGE} and acceleration follows."
+
+def test_render_keeps_non_consecutive_chunks_with_matching_edges_apart():
+    first = f"Chapter one opens the topic. {EDGE}"
+    third = f"{EDGE} in a later example."
+    assert render([(("a", 1), first), (("a", 3), third)]) == f"{first}\n\n{third}"
+
+def test_render_keeps_other_groups_apart():
+    first = f"Chapter one opens the topic. {EDGE}"
+    second = f"{EDGE} and acceleration follows."
+    assert render([(("a", 1), first), (("b", 2), second)]) == f"{first}\n\n{second}"
+
+def test_pack_stays_within_budget_in_reading_order():
+    passages = [(("a", 3), "three " * 10), (("a", 1), "one " * 10), (("a", 2), "two " * 30)]
+    text, used, tokens = pack(passages, 25, words)
+    assert used == 2 and tokens <= 25
+    assert text.index("one") < text.index("three") and "two" not in text
+
+def test_pack_cuts_best_passage_when_nothing_fits():
+    text, used, tokens = pack([(("a", 1), "word " * 50)], 10, words)
+    assert used == 1 and 0 < tokens <= 10
+
+def test_fuse_rewards_agreement():
+    assert fuse([["x", "y", "z"], ["y", "x", "w"]])[:2] in (["x", "y"], ["y", "x"])
+    assert fuse([["x", "y"], ["y", "z"]])[0] == "y"
+
+def test_bm25_ranks_matching_chunks_only():
+    index = BM25Index(["eigenvalues of a matrix", "the matrix is square", "unrelated lecture notes"])
+    hits = index.search("eigenvalues matrix")
+    assert [i for i, _ in hits] == [0, 1]
+    assert hits == index.search("eigenvalues matrix")
@@ -1,12 +1,19 @@
 from fastapi import FastAPI, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
-from faster_whisper import WhisperModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-from pydantic import BaseModel
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from transformers import (
+    AutoModelForCausalLM, AutoTokenizer, pipeline, LogitsProcessor, LogitsProcessorList,
+    StoppingCriteria, StoppingCriteriaList, TextStreamer, DynamicCache,
+)
+from pydantic import BaseModel, Field
+from typing import List, Optional
 import shutil
 import os
-import tempfile
+import io
 import yt_dlp
 import fitz  # PyMuPDF
 import re
@@ -14,19 +21,41 @@ import numpy as np
 import json
 import subprocess
 import torch
-from collections import Counter
+from collections import Counter, OrderedDict, defaultdict
 import time
 import difflib
 import random
+import gc
+import itertools
+import pickle
+import hashlib
+import sqlite3
+import asyncio
+import threading
+import uuid
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
+import multiprocessing
+import longform_worker
+import pdf_worker
+import abstractive
+import ann_index
+import retrieval
+import structured
+from extractive import accurate_35_summarize, METHOD_LABELS
+from contextlib import contextmanager, nullcontext
+from prometheus_client import Counter as MetricCounter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 # --- CRITICAL FIX: Prevent Deadlocks on Mac/Linux ---
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 # --- LangChain Imports ---
+import faiss
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 app = FastAPI()
 
@@ -41,71 +70,1551 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --------------------
+# Metrics & Tracing
+# --------------------
+# Prometheus series are served at /metrics. Setting TRACE_FILE additionally
+# appends one JSON line per timed span (stage, job, seconds, attributes).
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+STAGE_SECONDS = Histogram("lecture_stage_seconds", "Wall time of pipeline stages", ["stage"], buckets=SECONDS_BUCKETS)
+STAGE_WAIT = Histogram("lecture_stage_wait_seconds", "Time spent waiting for a stage slot", ["stage"], buckets=SECONDS_BUCKETS)
+QUEUE_WAIT = Histogram("lecture_queue_wait_seconds", "Time a job waited for a worker", ["kind"], buckets=SECONDS_BUCKETS)
+JOBS = MetricCounter("lecture_jobs_total", "Finished jobs", ["kind", "status"])
+AUDIO_SECONDS = MetricCounter("lecture_audio_seconds_total", "Audio transcribed, in seconds", ["model_size"])
+ASR_RTF = Histogram(
+    "lecture_asr_real_time_factor", "Whisper decode seconds per audio second", ["model_size"],
+    buckets=(0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4),
+)
+LLM_TOKENS = MetricCounter("lecture_llm_tokens_total", "Tokens run through the LLM", ["phase"])
+LLM_DRAFT_TOKENS = MetricCounter("lecture_llm_draft_tokens_total", "Assisted decoding draft tokens", ["mode", "result"])
+LLM_TOKENS_PER_SECOND = Histogram(
+    "lecture_llm_tokens_per_second", "LLM throughput per call", ["phase"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+)
+CACHE_LOOKUPS = MetricCounter("lecture_cache_lookups_total", "Result cache lookups", ["namespace", "result"])
+EMBEDDINGS = MetricCounter("lecture_embeddings_total", "Chunks passed to the embedding service", ["result"])
+MODEL_BYTES = Gauge("lecture_model_bytes", "Resident size of each loaded model", ["model"])
+PROCESS_RSS = Gauge("lecture_process_rss_bytes", "Resident set size of the API process")
+
+class Tracer:
+    """Records spans into STAGE_SECONDS and, when a trace file is set, as JSON lines."""
+    def __init__(self, path=TRACE_FILE):
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1) if path else None
+        self.job_id = lambda: None
+
+    def record(self, name, seconds, start=None, **attrs):
+        STAGE_SECONDS.labels(name).observe(seconds)
+        if self.file:
+            line = json.dumps({
+                "span": name,
+                "start": start or time.time() - seconds,
+                "seconds": round(seconds, 6),
+                "job_id": self.job_id(),
+                "thread": threading.current_thread().name,
+                **attrs,
+            }, default=str)
+            with self.lock:
+                self.file.write(line + "\n")
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Times the block; the yielded dict can be filled with attributes for the trace."""
+        wall, start = time.time(), time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(name, time.perf_counter() - start, wall, **attrs)
+
+tracer = Tracer()
+
+def observe_llm(phase, tokens, seconds):
+    LLM_TOKENS.labels(phase).inc(tokens)
+    if tokens and seconds > 0:
+        LLM_TOKENS_PER_SECOND.labels(phase).observe(tokens / seconds)
+
 # --------------------
 # 1. Load Models (Dynamic Loading)
 # --------------------
-print("Loading Models...")
+# Models are loaded on first use (or by background warmup) and unloaded in LRU
+# order once the resident total would exceed MODEL_RAM_BUDGET_MB. Code that runs
+# a model holds it with `with model_manager.use(name)`; pinned models are never
+# chosen for eviction, since their caller's reference would keep them alive and
+# the next get() would load a second copy.
+MB = 1024 * 1024
+MODEL_RAM_BUDGET_MB = int(os.getenv("MODEL_RAM_BUDGET_MB", "10240"))
+MODEL_WARMUP = [m.strip() for m in os.getenv("MODEL_WARMUP", "whisper:medium,llm").split(",") if m.strip()]
+LLM_DTYPE = os.getenv("LLM_DTYPE", "fp32")  # fp32 | bf16 | int8
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+PROCESS_RSS.set_function(rss_bytes)
+
+def torch_bytes(module):
+    tensors = itertools.chain(module.parameters(), module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class ModelManager:
+    def __init__(self, budget_mb=MODEL_RAM_BUDGET_MB):
+        self.budget = budget_mb * MB
+        self.loaders = {}
+        self.models = OrderedDict()
+        self.info = {}
+        self.lock = threading.Lock()
+        self.load_locks = defaultdict(threading.Lock)
+        self.pins = Counter()
+
+    def register(self, name, loader, estimate_mb):
+        """loader() returns (model, measured_bytes or None to fall back on RSS growth)."""
+        self.loaders[name] = loader
+        self.info[name] = {"bytes": estimate_mb * MB, "loaded": False, "loads": 0, "load_seconds": None, "last_used": None}
+
+    def _touch(self, name):
+        self.models.move_to_end(name)
+        self.info[name]["last_used"] = time.time()
+        return self.models[name]
+
+    def get(self, name):
+        with self.lock:
+            if name in self.models:
+                return self._touch(name)
+        with self.load_locks[name]:
+            with self.lock:
+                if name in self.models:
+                    return self._touch(name)
+                self._make_room(self.info[name]["bytes"], keep=name)
+
+            print(f"📥 Loading {name}...")
+            before = rss_bytes()
+            start = time.perf_counter()
+            with tracer.span("model_load", model=name):
+                model, size = self.loaders[name]()
+            elapsed = time.perf_counter() - start
+            size = size or max(rss_bytes() - before, 0) or self.info[name]["bytes"]
+
+            with self.lock:
+                self.models[name] = model
+                self.info[name].update(bytes=size, loaded=True, load_seconds=round(elapsed, 2))
+                self.info[name]["loads"] += 1
+                MODEL_BYTES.labels(name).set(size)
+                self._touch(name)
+                self._make_room(0, keep=name)
+            print(f"✅ {name} loaded in {elapsed:.1f}s ({size / MB:.0f} MB)")
+            return model
+
+    def acquire(self, name):
+        """get(), with the model pinned against eviction until release(name)."""
+        with self.lock:
+            self.pins[name] += 1
+        try:
+            return self.get(name)
+        except BaseException:
+            self.release(name)
+            raise
+
+    def release(self, name):
+        with self.lock:
+            self.pins[name] -= 1
+            # Pins may have held the total over budget; settle it now
+            self._make_room(0, keep=None)
+
+    @contextmanager
+    def use(self, name):
+        """Yields the model, pinned for the duration of the block."""
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(name)
+
+    def resident(self):
+        return sum(self.info[n]["bytes"] for n in self.models)
+
+    def _make_room(self, incoming, keep):
+        while self.resident() + incoming > self.budget:
+            # Least recently used first; pinned models are skipped, even if that
+            # leaves the total over budget until they are released
+            victim = next((n for n in self.models if n != keep and not self.pins[n]), None)
+            if victim is None:
+                break
+            del self.models[victim]
+            self.info[victim]["loaded"] = False
+            MODEL_BYTES.labels(victim).set(0)
+            gc.collect()
+            print(f"♻️ Unloaded {victim} to stay under the model RAM budget")
+
+    def unload(self, name):
+        with self.lock:
+            if self.models.pop(name, None) is not None:
+                self.info[name]["loaded"] = False
+                MODEL_BYTES.labels(name).set(0)
+                gc.collect()
+
+    def warmup(self, names=MODEL_WARMUP):
+        def run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"   ⚠️ Warmup of {name} failed: {e}")
+        threading.Thread(target=run, name="model-warmup", daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "budget_bytes": self.budget,
+                "resident_bytes": self.resident(),
+                "pinned": {n: c for n, c in self.pins.items() if c},
+                "rss_bytes": rss_bytes(),
+                "models": {n: dict(i) for n, i in self.info.items()},
+            }
 
+model_manager = ModelManager()
+
+# --------------------
+# A. Whisper (ASR)
+# --------------------
 # Model Registry
 WHISPER_MODELS = {
     "small": "small.en",
     "medium": "Systran/faster-distil-whisper-medium.en",
     "large": "Systran/faster-distil-whisper-large-v3"
 }
+WHISPER_ESTIMATE_MB = {"small": 500, "medium": 1000, "large": 1800}
 
-# Cache to store loaded models so we don't reload every request
-loaded_models = {}
+SAMPLE_RATE = 16000
 
-def get_whisper_model(size="medium"):
-    """Lazy loads the requested Whisper model size."""
-    if size not in WHISPER_MODELS:
-        size = "medium"
-    
-    if size not in loaded_models:
-        print(f"📥 Loading Whisper Model: {size.upper()} ({WHISPER_MODELS[size]})...")
-        loaded_models[size] = WhisperModel(WHISPER_MODELS[size], device="cpu", compute_type="int8")
-        print(f"✅ {size.upper()} Model Loaded!")
-    
-    return loaded_models[size]
+for size, name in WHISPER_MODELS.items():
+    model_manager.register(
+        f"whisper:{size}",
+        lambda name=name: (WhisperModel(name, device="cpu", compute_type="int8"), None),
+        WHISPER_ESTIMATE_MB[size],
+    )
 
-# Pre-load Medium (Default)
-get_whisper_model("medium")
+def whisper_key(size="medium"):
+    """Model manager name of the requested Whisper size (unknown sizes fall back to medium)."""
+    return f"whisper:{size if size in WHISPER_MODELS else 'medium'}"
 
 # --------------------
 # B. LLM for Notes & RAG (1.5B Model - Fast & Light)
 # --------------------
 LLM_ID = "Qwen/Qwen2.5-1.5B-Instruct"
-print(f"🚀 Loading Fast Model: {LLM_ID}...")
+LLM_ESTIMATE_MB = {"fp32": 6500, "bf16": 3400, "int8": 2200}
 
 tokenizer = AutoTokenizer.from_pretrained(LLM_ID)
-llm_model = AutoModelForCausalLM.from_pretrained(
-    LLM_ID,
-    dtype=torch.float32, 
-)
-llm_model.eval()
+
+def load_llm():
+    dtype = torch.bfloat16 if LLM_DTYPE == "bf16" else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(LLM_ID, dtype=dtype)
+    model.eval()
+    if LLM_DTYPE == "int8":
+        # Dynamic int8 quantization of the Linear layers; packed weights are
+        # invisible to parameters(), so size is measured from RSS instead
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model, None
+    return model, torch_bytes(model)
+
+model_manager.register("llm", load_llm, LLM_ESTIMATE_MB.get(LLM_DTYPE, 6500))
 
 # C. Legacy Summarizer
-summarizer = pipeline("summarization", model="facebook/bart-large-cnn", device=-1)
+SUMMARIZER_ID = "facebook/bart-large-cnn"
+SUMMARIZER_BACKEND = os.getenv("SUMMARIZER_BACKEND", "torch")  # torch | int8 | onnx
+SUMMARIZER_BATCH_SIZE = int(os.getenv("SUMMARIZER_BATCH_SIZE", "4"))
+SUMMARIZER_MAX_INPUT_TOKENS = int(os.getenv("SUMMARIZER_MAX_INPUT_TOKENS", "1000"))  # BART reads 1024
+SUMMARIZER_ONNX_DIR = os.getenv("SUMMARIZER_ONNX_DIR", os.path.join("onnx", "bart-large-cnn"))
+SUMMARIZER_ESTIMATE_MB = {"torch": 1700, "int8": 700, "onnx": 1700}
+
+def load_summarizer():
+    if SUMMARIZER_BACKEND == "onnx":
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        # Exported once, then loaded from disk
+        exported = os.path.exists(os.path.join(SUMMARIZER_ONNX_DIR, "config.json"))
+        model = ORTModelForSeq2SeqLM.from_pretrained(SUMMARIZER_ONNX_DIR if exported else SUMMARIZER_ID, export=not exported)
+        if not exported:
+            model.save_pretrained(SUMMARIZER_ONNX_DIR)
+        return pipeline("summarization", model=model, tokenizer=AutoTokenizer.from_pretrained(SUMMARIZER_ID)), None
+    pipe = pipeline("summarization", model=SUMMARIZER_ID, device=-1)
+    if SUMMARIZER_BACKEND == "int8":
+        # Same dynamic Linear quantization as LLM_DTYPE=int8; size comes from RSS
+        pipe.model = torch.ao.quantization.quantize_dynamic(pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return pipe, None
+    return pipe, torch_bytes(pipe.model)
+
+model_manager.register("summarizer", load_summarizer, SUMMARIZER_ESTIMATE_MB.get(SUMMARIZER_BACKEND, 1700))
+
+print(f"🚀 Warming up in background: {', '.join(MODEL_WARMUP) or 'nothing'}")
+model_manager.warmup()
 
-print("✅ All Systems Ready!")
+# --------------------
+# Job Queue: Off-Loop Execution & Backpressure
+# --------------------
+# Every heavy route runs on this bounded pool instead of the event loop, and
+# each blocking stage (download / ASR / LLM) takes a slot from its own limit.
+# Lecture-sized jobs can sit on a worker while they wait for the single ASR
+# slot, so short retrieval calls get a separate "light" lane and never queue
+# behind a whole lecture.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+LIGHT_JOB_WORKERS = int(os.getenv("LIGHT_JOB_WORKERS", "4"))
+LIGHT_JOB_KINDS = {"rag_query", "stream_rag_query", "library_search"}
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "16"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+STAGE_LIMITS = {
+    "download": int(os.getenv("DOWNLOAD_CONCURRENCY", "2")),
+    "asr": int(os.getenv("ASR_CONCURRENCY", "1")),
+    "llm": int(os.getenv("LLM_CONCURRENCY", "1")),
+}
+
+class QueueFullError(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, light_workers=LIGHT_JOB_WORKERS, max_queued=MAX_QUEUED_JOBS, ttl=JOB_TTL_SECONDS):
+        self.workers = {"heavy": workers, "light": light_workers}
+        self.executors = {
+            lane: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"job-{lane}")
+            for lane, n in self.workers.items()
+        }
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stage_slots = {name: threading.BoundedSemaphore(n) for name, n in STAGE_LIMITS.items()}
+        self.stage_active = {name: 0 for name in STAGE_LIMITS}
+        self.stage_waiting = {name: 0 for name in STAGE_LIMITS}
+
+    @contextmanager
+    def stage(self, name):
+        """Holds one concurrency slot of the given stage while the block runs."""
+        job = self.jobs.get(getattr(self.local, "job_id", None))
+        with self.lock:
+            self.stage_waiting[name] += 1
+        if job: job["stage"] = f"waiting:{name}"
+        waited = time.perf_counter()
+        self.stage_slots[name].acquire()
+        STAGE_WAIT.labels(name).observe(time.perf_counter() - waited)
+        with self.lock:
+            self.stage_waiting[name] -= 1
+            self.stage_active[name] += 1
+        if job: job["stage"] = name
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stage_active[name] -= 1
+            self.stage_slots[name].release()
+
+    def reporter(self):
+        """Returns a callback bound to this thread's job, safe to call from other threads."""
+        job = self.jobs.get(getattr(self.local, "job_id", None))
+        def report(**event):
+            if job is not None:
+                job["progress"] = event
+        return report
+
+    def report(self, **event):
+        """Records the latest progress event on the job owning this thread."""
+        self.reporter()(**event)
+
+    def cancel_event(self):
+        """The cancel flag of this thread's job; a fresh (never set) flag outside jobs."""
+        job = self.jobs.get(getattr(self.local, "job_id", None))
+        return job["cancel"] if job else threading.Event()
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job:
+            job["cancel"].set()
+
+    def pending(self, lane):
+        return sum(1 for j in self.jobs.values() if j["lane"] == lane and j["status"] in ("queued", "running"))
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Admits a job onto its lane's pool, or raises QueueFullError when that lane is saturated."""
+        lane = "light" if kind in LIGHT_JOB_KINDS else "heavy"
+        with self.lock:
+            self._prune()
+            if self.pending(lane) >= self.workers[lane] + self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.pending(lane)} {lane} jobs pending).")
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id,
+                "kind": kind,
+                "lane": lane,
+                "status": "queued",
+                "stage": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "status_code": None,
+                "progress": None,
+                "cancel": threading.Event(),
+            }
+            self.jobs[job_id] = job
+        job["future"] = self.executors[lane].submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        self.local.job_id = job["job_id"]
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        QUEUE_WAIT.labels(job["kind"]).observe(job["started_at"] - job["created_at"])
+        try:
+            job["result"] = fn(*args, **kwargs)
+            job["status"] = "done"
+            return job["result"]
+        except JobCancelled as e:
+            job["status"], job["error"], job["status_code"] = "cancelled", str(e), 499
+            raise
+        except HTTPException as e:
+            job["status"], job["error"], job["status_code"] = "failed", e.detail, e.status_code
+            raise
+        except Exception as e:
+            job["status"], job["error"], job["status_code"] = "failed", str(e), 500
+            raise
+        finally:
+            job["stage"] = None
+            job["finished_at"] = time.time()
+            JOBS.labels(job["kind"], job["status"]).inc()
+            self.local.job_id = None
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        stale = [k for k, j in self.jobs.items() if j["finished_at"] and j["finished_at"] < cutoff]
+        for k in stale:
+            del self.jobs[k]
+
+    def describe(self, job):
+        view = {k: v for k, v in job.items() if k not in ("future", "result", "cancel")}
+        if job["status"] == "queued":
+            view["queue_position"] = sum(
+                1 for j in self.jobs.values()
+                if j["lane"] == job["lane"] and j["status"] == "queued" and j["created_at"] < job["created_at"]
+            )
+        return view
+
+    def stats(self):
+        with self.lock:
+            counts = Counter(j["status"] for j in self.jobs.values())
+            return {
+                "llm_batcher": llm_batcher.stats if llm_batcher else None,
+                "workers": self.workers,
+                "max_queued": self.max_queued,
+                "pending": {lane: self.pending(lane) for lane in self.workers},
+                "queued": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "done": counts.get("done", 0),
+                "failed": counts.get("failed", 0),
+                "cancelled": counts.get("cancelled", 0),
+                "stages": {
+                    name: {"limit": STAGE_LIMITS[name], "active": self.stage_active[name], "waiting": self.stage_waiting[name]}
+                    for name in STAGE_LIMITS
+                },
+            }
+
+job_manager = JobManager()
+tracer.job_id = lambda: getattr(job_manager.local, "job_id", None)
+
+def admit_job(kind, fn, *args, **kwargs):
+    """Submits to the job pool; the one place backpressure becomes HTTP 429."""
+    try:
+        return job_manager.submit(kind, fn, *args, **kwargs)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+async def run_job(kind, fn, *args, **kwargs):
+    """Runs blocking work on the job pool without blocking the event loop."""
+    job = admit_job(kind, fn, *args, **kwargs)
+    return await asyncio.wrap_future(job["future"])
+
+def submit_job(kind, fn, *args, **kwargs):
+    return job_manager.describe(admit_job(kind, fn, *args, **kwargs))
+
+# --------------------
+# Content-Addressed Result Cache
+# --------------------
+# Transcripts, summaries, notes, quizzes and DOT code are stored on disk under
+# a hash of their inputs (content + model + stage parameters).
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+CACHE_MAX_MB = int(os.getenv("CACHE_MAX_MB", "2048"))
+
+def content_key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def file_digest(source, block_size=1 << 20):
+    """sha256 of a path, or of a seekable binary file (read from the start and rewound)."""
+    h = hashlib.sha256()
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        f.seek(0)
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    finally:
+        if isinstance(source, str):
+            f.close()
+        else:
+            f.seek(0)
+    return h.hexdigest()
+
+class ResultCache:
+    """Size-bounded on-disk store; least recently used files are evicted first."""
+    def __init__(self, root=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.metrics = defaultdict(lambda: {"hits": 0, "misses": 0, "writes": 0})
+        self.evictions = 0
+        self._scan()
+
+    def _scan(self):
+        """Picks up <namespace>/<xx>/<key>.json entries only; anything else under root is not ours to evict."""
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for dirpath, _, files in os.walk(self.root):
+            if os.path.dirname(os.path.dirname(dirpath)) != self.root:
+                continue
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self.entries[path] = size
+        self.total = sum(self.entries.values())
+
+    def _path(self, namespace, key, ext):
+        return os.path.join(self.root, namespace, key[:2], f"{key}.{ext}")
+
+    def _record(self, namespace, path, hit):
+        with self.lock:
+            self.metrics[namespace]["hits" if hit else "misses"] += 1
+            CACHE_LOOKUPS.labels(namespace, "hit" if hit else "miss").inc()
+            if hit and path in self.entries:
+                self.entries.move_to_end(path)
+        if hit:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def has(self, namespace, key, ext="json"):
+        return os.path.exists(self._path(namespace, key, ext))
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key, "json")
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._record(namespace, path, False)
+            return None
+        self._record(namespace, path, True)
+        return value
+
+    def put(self, namespace, key, value):
+        data = json.dumps(value).encode()
+        self._write(namespace, self._path(namespace, key, "json"), lambda f: f.write(data))
+
+    def _write(self, namespace, path, writer):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            writer(f)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+            self.metrics[namespace]["writes"] += 1
+            self._evict()
+
+    def _evict(self):
+        while self.total > self.max_bytes and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.total -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "namespaces": {k: dict(v) for k, v in self.metrics.items()},
+            }
+
+result_cache = ResultCache()
+
+# --------------------
+# LLM Batching Scheduler
+# --------------------
+# Concurrent generate_llm callers are gathered for a short window and decoded
+# together in one left-padded generate() call.
+LLM_BATCHING = os.getenv("LLM_BATCHING", "1") == "1"
+LLM_MAX_BATCH = int(os.getenv("LLM_MAX_BATCH", "8"))
+LLM_BATCH_WAIT_MS = int(os.getenv("LLM_BATCH_WAIT_MS", "15"))
+
+tokenizer.padding_side = "left"
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+
+class BatchRowControl(LogitsProcessor):
+    """Applies per-row temperature and ends each row at its own max_new_tokens."""
+    def __init__(self, prompt_len, max_new_tokens, temperatures, eos_token_id):
+        self.prompt_len = prompt_len
+        self.budgets = torch.tensor(max_new_tokens)
+        self.temperatures = torch.tensor(temperatures, dtype=torch.float32)
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        scores = scores / self.temperatures.to(scores.device)[:, None]
+        done = (input_ids.shape[-1] - self.prompt_len) >= self.budgets.to(scores.device)
+        if done.any():
+            scores[done] = -float("inf")
+            scores[done, self.eos_token_id] = 0.0
+        return scores
+
+class LLMBatcher:
+    def __init__(self, max_batch=LLM_MAX_BATCH, wait_ms=LLM_BATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self.queue = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "max_batch_seen": 0}
+        self.thread = threading.Thread(target=self._loop, name="llm-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, messages, max_new_tokens, temperature):
+        future = Future()
+        self.queue.put((messages, max_new_tokens, temperature, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                outputs = self._generate(batch)
+                for (*_, future), text in zip(batch, outputs):
+                    future.set_result(text)
+            except Exception as e:
+                for *_, future in batch:
+                    future.set_exception(e)
+
+    def _generate(self, batch):
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+        if len(batch) == 1:
+            # A lone request gains nothing from padding; take the prefix-cached path
+            messages, max_new_tokens, temperature, _ = batch[0]
+            return [generate_direct(messages, max_new_tokens, temperature)]
+
+        prompts = [tokenizer.apply_chat_template(m, add_generation_prompt=True) for m, *_ in batch]
+        # Left-padded by hand: tokenizer(padding=True) would flip the shared Rust
+        # tokenizer's padding state while other threads are encoding with it
+        prompt_len = max(len(p) for p in prompts)
+        input_ids = torch.full((len(prompts), prompt_len), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompts), prompt_len), dtype=torch.long)
+        for i, p in enumerate(prompts):
+            input_ids[i, prompt_len - len(p):] = torch.as_tensor(p)
+            attention_mask[i, prompt_len - len(p):] = 1
+        control = BatchRowControl(
+            prompt_len,
+            [b[1] for b in batch],
+            [max(b[2], 1e-3) for b in batch],
+            tokenizer.eos_token_id,
+        )
+
+        with job_manager.stage("llm"), model_manager.use("llm") as llm_model, torch.no_grad(), \
+                tracer.span("llm_batch", rows=len(batch)) as span:
+            start = time.perf_counter()
+            out = llm_model.generate(
+                input_ids=input_ids.to(llm_model.device),
+                attention_mask=attention_mask.to(llm_model.device),
+                max_new_tokens=max(b[1] for b in batch),
+                temperature=1.0,
+                do_sample=True,
+                repetition_penalty=1.1,
+                logits_processor=LogitsProcessorList([control]),
+                pad_token_id=tokenizer.pad_token_id,
+            )
+            # Prefill and decode share one generate() call here; tokens count both
+            prompt_tokens = int(attention_mask.sum())
+            new_tokens = int((out[:, prompt_len:] != tokenizer.pad_token_id).sum())
+            span.update(prompt_tokens=prompt_tokens, new_tokens=new_tokens)
+            observe_llm("batch", prompt_tokens + new_tokens, time.perf_counter() - start)
+
+        return [tokenizer.decode(row[prompt_len:], skip_special_tokens=True) for row in out]
+
+llm_batcher = LLMBatcher() if LLM_BATCHING else None
+
+# --------------------
+# Prompt Prefix KV Cache
+# --------------------
+# Prompts are hashed in blocks of PREFIX_BLOCK_TOKENS. A new prompt reuses the
+# key/values of the longest block-aligned prefix it shares with any cached
+# prompt (system rules, the same notes or lecture context) and only prefills
+# the rest.
+PREFIX_CACHE_MB = int(os.getenv("PREFIX_CACHE_MB", "1024"))
+PREFIX_BLOCK_TOKENS = int(os.getenv("PREFIX_BLOCK_TOKENS", "16"))
+
+def kv_bytes_per_token(llm_model):
+    cfg = llm_model.config
+    head_dim = getattr(cfg, "head_dim", None) or cfg.hidden_size // cfg.num_attention_heads
+    itemsize = torch.finfo(llm_model.dtype).bits // 8
+    return 2 * cfg.num_hidden_layers * cfg.num_key_value_heads * head_dim * itemsize
+
+class PrefixCache:
+    """LRU of prompt KV caches under a memory budget, indexed by block-prefix hashes."""
+    def __init__(self, budget_mb=PREFIX_CACHE_MB, block=PREFIX_BLOCK_TOKENS):
+        self.budget = budget_mb * MB
+        self.block = block
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # entry_id -> {"cache", "bytes", "keys"}
+        self.blocks = {}              # prefix hash -> entry_id of the newest prompt covering it
+        self.total = 0
+        self.metrics = {"lookups": 0, "hits": 0, "reused_tokens": 0, "prefilled_tokens": 0, "prefill_seconds": 0.0, "evictions": 0}
+
+    def _hashes(self, ids):
+        """Hash of every block-aligned prefix of ids, shortest first."""
+        h = hashlib.sha1()
+        ids = np.asarray(ids, dtype=np.int64)
+        out = []
+        for end in range(self.block, len(ids) + 1, self.block):
+            h.update(ids[end - self.block:end].tobytes())
+            out.append((end, h.hexdigest()))
+        return out
+
+    @staticmethod
+    def head(cache, end):
+        """A new DynamicCache with clones of only the first end positions of every layer."""
+        if hasattr(cache, "layers"):
+            pairs = [(layer.keys, layer.values) for layer in cache.layers]
+        else:
+            pairs = zip(cache.key_cache, cache.value_cache)
+        out = DynamicCache()
+        for i, (k, v) in enumerate(pairs):
+            out.update(k[..., :end, :].clone(), v[..., :end, :].clone(), i)
+        return out
+
+    def lookup(self, ids):
+        """A private copy of the longest cached prefix of ids, and its length."""
+        if self.budget <= 0:
+            return None, 0
+        snapshot, end = None, 0
+        with self.lock:
+            self.metrics["lookups"] += 1
+            for end, key in reversed(self._hashes(ids)):
+                entry_id = self.blocks.get(key)
+                if entry_id in self.entries:
+                    self.entries.move_to_end(entry_id)
+                    snapshot = self.entries[entry_id]["cache"]
+                    self.metrics["hits"] += 1
+                    self.metrics["reused_tokens"] += end
+                    break
+        if snapshot is None:
+            return None, 0
+        # Stored snapshots are never mutated, so the clone can run unlocked
+        return self.head(snapshot, end), end
+
+    def store(self, ids, cache, bytes_per_token):
+        size = len(ids) * bytes_per_token
+        if self.budget <= 0 or size > self.budget or len(ids) < self.block:
+            return
+        keys = [key for _, key in self._hashes(ids)]
+        entry_id = keys[-1]
+        if entry_id in self.entries:
+            return
+        snapshot = self.head(cache, len(ids))
+        with self.lock:
+            if entry_id in self.entries:
+                self.entries.move_to_end(entry_id)
+                return
+            self.entries[entry_id] = {"cache": snapshot, "bytes": size, "keys": keys}
+            self.total += size
+            for key in keys:
+                self.blocks[key] = entry_id
+            while self.total > self.budget:
+                old_id, old = self.entries.popitem(last=False)
+                self.total -= old["bytes"]
+                self.metrics["evictions"] += 1
+                for key in old["keys"]:
+                    if self.blocks.get(key) == old_id:
+                        del self.blocks[key]
+
+    def record_prefill(self, tokens, seconds):
+        with self.lock:
+            self.metrics["prefilled_tokens"] += tokens
+            self.metrics["prefill_seconds"] += seconds
+
+    def stats(self):
+        with self.lock:
+            m = dict(self.metrics)
+            per_token = m["prefill_seconds"] / m["prefilled_tokens"] if m["prefilled_tokens"] else 0.0
+            return {
+                **m,
+                "hit_rate": round(m["hits"] / m["lookups"], 3) if m["lookups"] else None,
+                "saved_prefill_seconds": round(m["reused_tokens"] * per_token, 2),
+                "prefill_seconds": round(m["prefill_seconds"], 2),
+                "entries": len(self.entries),
+                "bytes": self.total,
+                "max_bytes": self.budget,
+            }
+
+prefix_cache = PrefixCache()
+
+def prefill(llm_model, input_ids, upto):
+    """KV cache for input_ids[:, :upto], prefilling only what no cached prompt shares."""
+    cache, reused = prefix_cache.lookup(input_ids[0, :upto].tolist())
+    if reused < upto:
+        start = time.perf_counter()
+        # Only the cache is wanted here; skip the vocab projection for all but the last position
+        out = llm_model(input_ids=input_ids[:, reused:upto], past_key_values=cache, use_cache=True, logits_to_keep=1)
+        cache = out.past_key_values
+        elapsed = time.perf_counter() - start
+        prefix_cache.record_prefill(upto - reused, elapsed)
+        observe_llm("prefill", upto - reused, elapsed)
+        tracer.record("llm_prefill", elapsed, tokens=upto - reused, reused=reused)
+        prefix_cache.store(input_ids[0, :upto].tolist(), cache, kv_bytes_per_token(llm_model))
+    return cache
+
+# --------------------
+# Token Streaming
+# --------------------
+# A streamed request skips the batcher and decodes on its own so every token can
+# be pushed to the client the moment generate() produces it.
+class TokenStream(TextStreamer):
+    """Emits decoded text as it is generated and records time-to-first-token and tokens/sec."""
+    def __init__(self, emit, cancel=None, event="token"):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.emit = emit
+        self.cancel = cancel or threading.Event()
+        self.event = event
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.tokens = 0
+        self.assist = None
+
+    def put(self, value):
+        if not self.next_tokens_are_prompt:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.tokens += value.numel()
+        super().put(value)
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.emit(self.event, {"text": text})
+        if stream_end:
+            self.finished_at = time.perf_counter()
+
+    def stats(self):
+        if self.first_token_at is None:
+            return {"tokens": 0, "ttft_ms": None, "tokens_per_second": None, "cancelled": self.cancel.is_set()}
+        decode = (self.finished_at or time.perf_counter()) - self.first_token_at
+        stats = {
+            "tokens": self.tokens,
+            "ttft_ms": round((self.first_token_at - self.started) * 1000, 1),
+            "tokens_per_second": round(self.tokens / decode, 2) if decode > 0 else None,
+            "cancelled": self.cancel.is_set(),
+        }
+        if self.assist:
+            stats["assist"] = self.assist
+        return stats
+
+class CancelGeneration(StoppingCriteria):
+    """Ends generate() at the next token once the client has gone away."""
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+
+# --------------------
+# Assisted Decoding (opt-in per endpoint)
+# --------------------
+# Decoding the 1.5B model on CPU is memory-bandwidth bound, so checking several
+# drafted tokens in one forward costs about the same as producing one. Drafts
+# come from prompt n-gram lookup (notes and answers copy heavily from their
+# context) or a small draft model. LLM_ASSIST maps endpoints to a mode, e.g.
+# "notes=ngram,rag=draft"; a bare mode applies to every endpoint. Assisted
+# requests run one at a time (no batcher) and skip the prefix KV cache.
+LLM_ASSIST_MODES = ("off", "ngram", "draft")
+LLM_ASSIST_ENDPOINTS = ("notes", "rag")
+LLM_ASSIST_NGRAM_TOKENS = int(os.getenv("LLM_ASSIST_NGRAM_TOKENS", "10"))
+LLM_DRAFT_ID = os.getenv("LLM_DRAFT_ID", "Qwen/Qwen2.5-0.5B-Instruct")
+
+def parse_assist(spec):
+    modes = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        endpoint, _, mode = part.rpartition("=")
+        if mode not in LLM_ASSIST_MODES or (endpoint and endpoint not in LLM_ASSIST_ENDPOINTS):
+            raise ValueError(f"Bad LLM_ASSIST entry '{part}': use <mode> or <endpoint>=<mode> with "
+                             f"endpoint in {LLM_ASSIST_ENDPOINTS} and mode in {LLM_ASSIST_MODES}")
+        for e in ([endpoint] if endpoint else LLM_ASSIST_ENDPOINTS):
+            modes[e] = mode
+    return modes
+
+LLM_ASSIST = parse_assist(os.getenv("LLM_ASSIST", ""))
+
+def load_draft():
+    dtype = torch.bfloat16 if LLM_DTYPE == "bf16" else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(LLM_DRAFT_ID, dtype=dtype)
+    model.eval()
+    return model, torch_bytes(model)
+
+model_manager.register("llm_draft", load_draft, 1000 if LLM_DTYPE == "bf16" else 2000)
+
+class DraftMonitor:
+    """Records the input length of every target-model forward made by this thread.
+
+    Each verification forward is fed the last token plus the drafted ones and
+    yields exactly one token of its own, so drafted = inputs - 1 per step and
+    accepted = new tokens - forwards.
+    """
+    def __init__(self, model, prompt_len):
+        self.model = model
+        self.prompt_len = prompt_len
+        self.thread = threading.get_ident()
+        self.lengths = []
+
+    def hook(self, module, args, kwargs):
+        ids = kwargs.get("input_ids")
+        if ids is None and args:
+            ids = args[0]
+        if ids is not None and threading.get_ident() == self.thread:
+            self.lengths.append(ids.shape[-1])
+
+    def __enter__(self):
+        self.handle = self.model.register_forward_pre_hook(self.hook, with_kwargs=True)
+        return self
+
+    def __exit__(self, *exc):
+        self.handle.remove()
+
+    def counts(self, new_tokens):
+        """(drafted, accepted); the first forward also carries the prompt."""
+        if not self.lengths:
+            return 0, 0
+        drafted = max(self.lengths[0] - self.prompt_len, 0) + sum(n - 1 for n in self.lengths[1:])
+        return drafted, min(max(new_tokens - len(self.lengths), 0), drafted)
+
+class AssistStats:
+    """Per-mode decode throughput and draft acceptance of direct (unbatched) requests."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.modes = defaultdict(lambda: {"requests": 0, "tokens": 0, "seconds": 0.0, "drafted": 0, "accepted": 0})
+
+    def observe(self, mode, tokens, seconds, drafted=0, accepted=0):
+        with self.lock:
+            m = self.modes[mode]
+            m["requests"] += 1
+            m["tokens"] += tokens
+            m["seconds"] += seconds
+            m["drafted"] += drafted
+            m["accepted"] += accepted
+        if mode != "off":
+            LLM_DRAFT_TOKENS.labels(mode, "drafted").inc(drafted)
+            LLM_DRAFT_TOKENS.labels(mode, "accepted").inc(accepted)
+
+    def describe(self):
+        with self.lock:
+            return {
+                mode: {
+                    **m,
+                    "seconds": round(m["seconds"], 2),
+                    "tokens_per_second": round(m["tokens"] / m["seconds"], 2) if m["seconds"] else None,
+                    "acceptance_rate": round(m["accepted"] / m["drafted"], 3) if m["drafted"] else None,
+                }
+                for mode, m in self.modes.items()
+            }
+
+assist_stats = AssistStats()
+
+@contextmanager
+def assist_kwargs(mode):
+    """generate() kwargs for an assist mode; the draft model stays pinned inside the block."""
+    if mode == "ngram":
+        yield {"prompt_lookup_num_tokens": LLM_ASSIST_NGRAM_TOKENS}
+    elif mode == "draft":
+        with model_manager.use("llm_draft") as draft:
+            yield {"assistant_model": draft}
+    else:
+        yield {}
 
 # --------------------
 # Helper: LLM Generation
 # --------------------
-def generate_llm(messages, max_new_tokens=1024, temperature=0.7):
+def generate_llm(messages, max_new_tokens=1024, temperature=0.7, stream=None, endpoint=None):
     """Runs the Qwen model to generate text/code"""
+    assist = LLM_ASSIST.get(endpoint, "off")
+    if llm_batcher and stream is None and assist == "off":
+        return llm_batcher.submit(messages, max_new_tokens, temperature).result()
+    return generate_direct(messages, max_new_tokens, temperature, stream, assist)
+
+def generate_direct(messages, max_new_tokens=1024, temperature=0.7, stream=None, assist="off"):
+    """Single-request generate(), on top of the prefix KV cache or assisted by a drafter."""
     text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    inputs = tokenizer(text, return_tensors="pt").to(llm_model.device)
+    inputs = tokenizer(text, return_tensors="pt")
+    prompt_len = inputs.input_ids.shape[-1]
+    extra = {}
+    if stream is not None:
+        extra = {"streamer": stream, "stopping_criteria": StoppingCriteriaList([CancelGeneration(stream.cancel)])}
     
-    with torch.no_grad():
-        out = llm_model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            temperature=temperature,
-            do_sample=True,
-            repetition_penalty=1.1
+    with job_manager.stage("llm"), model_manager.use("llm") as llm_model, assist_kwargs(assist) as assisted, torch.no_grad():
+        inputs = inputs.to(llm_model.device)
+        extra.update(assisted)
+        monitor = None
+        if assist == "off":
+            # generate() only runs the final prompt token on top of the prefilled cache
+            extra["past_key_values"] = prefill(llm_model, inputs.input_ids, prompt_len - 1)
+        else:
+            monitor = DraftMonitor(llm_model, prompt_len)
+        start = time.perf_counter()
+        with monitor or nullcontext():
+            out = llm_model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                do_sample=True,
+                repetition_penalty=1.1,
+                pad_token_id=tokenizer.pad_token_id,
+                **extra
+            )
+        elapsed = time.perf_counter() - start
+    new_tokens = out.shape[-1] - prompt_len
+    drafted, accepted = monitor.counts(new_tokens) if monitor else (0, 0)
+    assist_stats.observe(assist, new_tokens, elapsed, drafted, accepted)
+    observe_llm("decode" if assist == "off" else f"decode_{assist}", new_tokens, elapsed)
+    tracer.record("llm_decode", elapsed, tokens=new_tokens, streamed=stream is not None,
+                  assist=assist, drafted=drafted, accepted=accepted)
+    if stream is not None and assist != "off":
+        stream.assist = {
+            "mode": assist,
+            "drafted": drafted,
+            "accepted": accepted,
+            "acceptance_rate": round(accepted / drafted, 3) if drafted else None,
+        }
+    if stream is not None and stream.cancel.is_set():
+        raise JobCancelled("Client disconnected; generation stopped.")
+    return tokenizer.decode(out[0][prompt_len:], skip_special_tokens=True)
+
+# --------------------
+# Helper: Structured Generation
+# --------------------
+# Quiz JSON and diagram DOT are decoded under a grammar (see structured.py), so
+# they parse on the first pass and decoding stops at the closing bracket.
+structured_decoder = structured.StructuredDecoder(tokenizer)
+
+def generate_structured(messages, program, temperature=0.3, stream=None):
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    prompt_ids = tokenizer(text, return_tensors="pt").input_ids
+    cancel = stream.cancel if stream is not None else None
+
+    with job_manager.stage("llm"), model_manager.use("llm") as llm_model, torch.no_grad():
+        prompt_ids = prompt_ids.to(llm_model.device)
+        past = prefill(llm_model, prompt_ids, prompt_ids.shape[-1] - 1)
+        with tracer.span("llm_structured"):
+            result = structured_decoder.run(llm_model, prompt_ids, program, temperature, stream, cancel, past)
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled("Client disconnected; generation stopped.")
+    return result
+
+def generate_structured_many(messages_list, programs, temperature=0.3, cancel=None):
+    """Yields (position, result) as each group of LLM_MAX_BATCH prompts is decoded in lockstep."""
+    for start in range(0, len(messages_list), LLM_MAX_BATCH):
+        group = list(zip(messages_list[start:start + LLM_MAX_BATCH], programs[start:start + LLM_MAX_BATCH]))
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled("Client disconnected; generation stopped.")
+        if len(group) == 1:
+            # A lone prompt gains nothing from padding; take the prefix-cached path
+            results = [generate_structured(*group[0], temperature=temperature)]
+        else:
+            prompts = [
+                tokenizer(tokenizer.apply_chat_template(m, tokenize=False, add_generation_prompt=True)).input_ids
+                for m, _ in group
+            ]
+            with job_manager.stage("llm"), model_manager.use("llm") as llm_model, torch.no_grad(), \
+                    tracer.span("llm_structured_batch", rows=len(group)):
+                results = structured_decoder.run_batch(
+                    llm_model, prompts, [p for _, p in group], temperature, cancel, tokenizer.pad_token_id,
+                )
+            if cancel is not None and cancel.is_set():
+                raise JobCancelled("Client disconnected; generation stopped.")
+        for offset, result in enumerate(results):
+            yield start + offset, result
+
+# --------------------
+# Embedding Service (batched, persistent vector cache)
+# --------------------
+# Chunk vectors are cached in SQLite under a hash of (model, backend, text), so
+# re-ingesting a document or overlapping text only embeds the new chunks.
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")  # torch | onnx | onnx-int8
+EMBED_ONNX_INT8_FILE = os.getenv("EMBED_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "128"))
+# Own directory and budget: the vector DB must not sit under the ResultCache root
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embeddings")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+EMBED_ROW_BYTES = 384 * 4 + 128  # MiniLM float32 vector + key and SQLite row overhead
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", str(EMBED_CACHE_MAX_MB * MB // EMBED_ROW_BYTES)))
+
+class EmbeddingService(Embeddings):
+    def __init__(self, model_name=EMBED_MODEL, backend=EMBED_BACKEND, batch_size=EMBED_BATCH_SIZE):
+        model_kwargs = {"device": "cpu"}
+        if backend.startswith("onnx"):
+            model_kwargs["backend"] = "onnx"
+            if backend == "onnx-int8":
+                model_kwargs["model_kwargs"] = {"file_name": EMBED_ONNX_INT8_FILE}
+        self.inner = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs=model_kwargs,
+            encode_kwargs={"batch_size": batch_size},
+        )
+        self.tag = f"{model_name}:{backend}"
+        self.lock = threading.Lock()
+        os.makedirs(EMBED_CACHE_DIR, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(EMBED_CACHE_DIR, "embeddings.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vec BLOB)")
+        self.db.commit()
+        self.stats = {"requested": 0, "cache_hits": 0, "embedded": 0, "embed_seconds": 0.0}
+
+    def _lookup(self, keys):
+        found = {}
+        keys = list(keys)
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                rows = self.db.execute(
+                    f"SELECT key, vec FROM vectors WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update((k, np.frombuffer(v, dtype=np.float32)) for k, v in rows)
+        return found
+
+    def _store(self, items):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vec) VALUES (?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items],
+            )
+            overflow = self.db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0] - EMBED_CACHE_MAX_ROWS
+            if overflow > 0:
+                # Oldest inserts go first
+                self.db.execute("DELETE FROM vectors WHERE rowid IN (SELECT rowid FROM vectors ORDER BY rowid LIMIT ?)", (overflow,))
+            self.db.commit()
+
+    def embed_documents(self, texts):
+        keys = [content_key(self.tag, t) for t in texts]
+        vectors = self._lookup(set(keys))
+        missing = {k: t for k, t in zip(keys, texts) if k not in vectors}
+
+        if missing:
+            start = time.perf_counter()
+            with tracer.span("embed", chunks=len(missing)):
+                fresh = self.inner.embed_documents(list(missing.values()))
+            elapsed = time.perf_counter() - start
+            new = dict(zip(missing.keys(), (np.asarray(v, dtype=np.float32) for v in fresh)))
+            self._store(new.items())
+            vectors.update(new)
+            self.stats["embedded"] += len(missing)
+            self.stats["embed_seconds"] += elapsed
+
+        self.stats["requested"] += len(texts)
+        self.stats["cache_hits"] += len(texts) - len(missing)
+        EMBEDDINGS.labels("miss").inc(len(missing))
+        EMBEDDINGS.labels("hit").inc(len(texts) - len(missing))
+        return [vectors[k].tolist() for k in keys]
+
+    def embed_query(self, text):
+        return self.inner.embed_query(text)
+
+    def describe(self):
+        seconds = self.stats["embed_seconds"]
+        return {
+            **self.stats,
+            "backend": self.tag,
+            "batch_size": EMBED_BATCH_SIZE,
+            "chunks_per_second": round(self.stats["embedded"] / seconds, 1) if seconds else None,
+        }
+
+# --------------------
+# RAG Index Registry (one FAISS index per lecture)
+# --------------------
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "indexes")
+RAG_INDEX_BUDGET_MB = int(os.getenv("RAG_INDEX_BUDGET_MB", "512"))
+
+class LectureIndex:
+    def __init__(self, store, writable=True, dirty=True):
+        self.store = store
+        self.writable = writable
+        self.dirty = dirty
+        self.refresh_size()
+
+    def refresh_size(self):
+        index = self.store.index
+        texts = sum(len(d.page_content) for d in self.store.docstore._dict.values())
+        self.nbytes = index.ntotal * index.d * 4 + texts
+        self.bm25 = None  # chunks changed; rebuilt on the next query
+
+    def keyword_index(self):
+        """(BM25 index, docs by position) over the lecture's chunks, built lazily."""
+        if self.bm25 is None:
+            docs = [self.store.docstore.search(i) for i in self.store.index_to_docstore_id.values()]
+            self.bm25 = (retrieval.BM25Index([d.page_content for d in docs]), docs)
+        return self.bm25
+
+class IndexRegistry:
+    """LRU of per-lecture FAISS indexes under a memory budget, spilled to disk on eviction."""
+    def __init__(self, embeddings, root=RAG_INDEX_DIR, budget_mb=RAG_INDEX_BUDGET_MB):
+        self.embeddings = embeddings
+        self.root = root
+        self.budget = budget_mb * 1024 * 1024
+        self.indexes = OrderedDict()
+        self.lock = threading.RLock()
+        self.stats = {"hits": 0, "disk_loads": 0, "evictions": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, lecture_id):
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", lecture_id))
+
+    def _load(self, lecture_id, writable):
+        path = self._path(lecture_id)
+        if not os.path.exists(os.path.join(path, "index.faiss")):
+            return None
+        flags = 0 if writable else faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        try:
+            index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+        except RuntimeError:
+            # Not every index type supports mmap; fall back to a normal read
+            index = faiss.read_index(os.path.join(path, "index.faiss"))
+            writable = True
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        self.stats["disk_loads"] += 1
+        store = FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+        return LectureIndex(store, writable=writable, dirty=False)
+
+    def get(self, lecture_id, writable=False):
+        with self.lock:
+            entry = self.indexes.get(lecture_id)
+            if entry and (entry.writable or not writable):
+                self.stats["hits"] += 1
+                self.indexes.move_to_end(lecture_id)
+                return entry
+            entry = self._load(lecture_id, writable)
+            if entry:
+                self.indexes[lecture_id] = entry
+                self._evict()
+            return entry
+
+    def put(self, lecture_id, store):
+        with self.lock:
+            self.indexes[lecture_id] = LectureIndex(store)
+            self.indexes.move_to_end(lecture_id)
+            self._evict()
+
+    def _append(self, entry, docs):
+        if docs:
+            entry.store.add_documents(docs, ids=[d.metadata["chunk_id"] for d in docs])
+            entry.dirty = True
+        entry.refresh_size()
+        self._evict()
+
+    def add(self, lecture_id, docs):
+        """Adds chunks the index does not hold yet; nothing is rebuilt."""
+        docs = list({d.metadata["chunk_id"]: d for d in docs}.values())
+        with self.lock:
+            entry = self.get(lecture_id, writable=True)
+            if entry is None:
+                if docs:
+                    ids = [d.metadata["chunk_id"] for d in docs]
+                    self.put(lecture_id, FAISS.from_documents(docs, self.embeddings, ids=ids))
+                return
+            existing = set(entry.store.index_to_docstore_id.values())
+            self._append(entry, [d for d in docs if d.metadata["chunk_id"] not in existing])
+
+    def sync(self, lecture_id, docs):
+        """Makes the index hold exactly these chunks, embedding only the new ones."""
+        docs = list({d.metadata["chunk_id"]: d for d in docs}.values())
+        with self.lock:
+            entry = self.get(lecture_id, writable=True)
+            if entry is None:
+                return self.add(lecture_id, docs)
+            wanted = {d.metadata["chunk_id"] for d in docs}
+            existing = set(entry.store.index_to_docstore_id.values())
+            stale = list(existing - wanted)
+            if stale:
+                entry.store.delete(stale)
+                entry.dirty = True
+            self._append(entry, [d for d in docs if d.metadata["chunk_id"] not in existing])
+
+    def drop(self, lecture_id):
+        with self.lock:
+            self.indexes.pop(lecture_id, None)
+            shutil.rmtree(self._path(lecture_id), ignore_errors=True)
+
+    def save(self, lecture_id):
+        with self.lock:
+            entry = self.indexes.get(lecture_id)
+            if entry and entry.dirty:
+                entry.store.save_local(self._path(lecture_id))
+                entry.dirty = False
+
+    def _evict(self):
+        while len(self.indexes) > 1 and sum(e.nbytes for e in self.indexes.values()) > self.budget:
+            lecture_id, entry = next(iter(self.indexes.items()))
+            if entry.dirty:
+                entry.store.save_local(self._path(lecture_id))
+            del self.indexes[lecture_id]
+            self.stats["evictions"] += 1
+            print(f"   ♻️ Evicted RAG index '{lecture_id}' to disk")
+
+    def describe(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "resident": {k: e.nbytes for k, e in self.indexes.items()},
+                "resident_bytes": sum(e.nbytes for e in self.indexes.values()),
+                "budget_bytes": self.budget,
+            }
+
+# --------------------
+# RAG Library Index (course-wide ANN search)
+# --------------------
+# Per-lecture flat indexes stay as they are; this index is built over all of
+# them so a question can be searched across a whole course library.
+RAG_ANN_BACKEND = os.getenv("RAG_ANN_BACKEND", "hnsw")  # flat | hnsw | ivfpq
+RAG_ANN_TRAIN_SAMPLE = int(os.getenv("RAG_ANN_TRAIN_SAMPLE", "100000"))
+RAG_ANN_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "16"))
+RAG_ANN_EF_SEARCH = int(os.getenv("RAG_ANN_EF_SEARCH", "64"))
+# ivfpq re-ranks nprobe's top k * RAG_ANN_REFINE PQ candidates by exact distance
+# (the raw vectors are kept for this); 1 leaves recall capped by the PQ error
+RAG_ANN_REFINE = int(os.getenv("RAG_ANN_REFINE", "4"))
+LIBRARY_DIR = os.path.join(RAG_INDEX_DIR, "_library")
+
+class LibraryIndex:
+    """One ANN index over every persisted lecture; chunk text and metadata live in SQLite."""
+    def __init__(self, registry, embeddings):
+        self.registry = registry
+        self.embeddings = embeddings
+        self.lock = threading.RLock()
+        self.index = None
+        self.db = None
+        self.info = {}
+        self._open()
+
+    def _open(self):
+        index_path = os.path.join(LIBRARY_DIR, "index.faiss")
+        db_path = os.path.join(LIBRARY_DIR, "chunks.sqlite")
+        if not os.path.exists(index_path):
+            return
+        self.index = faiss.read_index(index_path)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with open(os.path.join(LIBRARY_DIR, "info.json")) as f:
+            self.info = json.load(f)
+
+    def lecture_ids(self):
+        root = self.registry.root
+        return sorted(
+            name for name in os.listdir(root)
+            if not name.startswith("_") and os.path.exists(os.path.join(root, name, "index.faiss"))
         )
-    return tokenizer.decode(out[0][inputs.input_ids.shape[-1]:], skip_special_tokens=True)
+
+    def _lecture_chunks(self, lecture_id):
+        store = self.registry.get(lecture_id).store
+        vectors = store.index.reconstruct_n(0, store.index.ntotal)
+        docs = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(store.index.ntotal)]
+        return vectors, docs
+
+    def build(self, backend=RAG_ANN_BACKEND):
+        """Trains on an even sample across lectures, then adds every chunk lecture by lecture."""
+        lectures = self.lecture_ids()
+        rng = np.random.default_rng(0)
+        per_lecture = max(1, RAG_ANN_TRAIN_SAMPLE // max(len(lectures), 1))
+
+        # Pass 1: training sample
+        samples, total = [], 0
+        for lecture_id in lectures:
+            vectors, _ = self._lecture_chunks(lecture_id)
+            total += len(vectors)
+            if len(vectors):
+                pick = rng.choice(len(vectors), size=min(per_lecture, len(vectors)), replace=False)
+                samples.append(vectors[pick])
+        if total == 0:
+            raise HTTPException(status_code=400, detail="No lecture indexes to build a library from.")
+
+        start = time.perf_counter()
+        train = np.concatenate(samples)
+        try:
+            index = ann_index.build_index(train.shape[1], backend, train, total)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Pass 2: vectors into the index, text + metadata into SQLite (ids = positions)
+        os.makedirs(LIBRARY_DIR, exist_ok=True)
+        tmp_db = os.path.join(LIBRARY_DIR, f"chunks.{uuid.uuid4().hex}.tmp")
+        db = sqlite3.connect(tmp_db, check_same_thread=False)
+        db.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, lecture_id TEXT, course_id TEXT, text TEXT, metadata TEXT)")
+        next_id = 0
+        for lecture_id in lectures:
+            vectors, docs = self._lecture_chunks(lecture_id)
+            if not len(vectors):
+                continue
+            index.add(vectors)
+            db.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?)", [
+                (next_id + i, lecture_id, d.metadata.get("course_id"), d.page_content, json.dumps(d.metadata))
+                for i, d in enumerate(docs)
+            ])
+            next_id += len(vectors)
+        db.execute("CREATE INDEX chunks_lecture ON chunks (lecture_id)")
+        db.execute("CREATE INDEX chunks_course ON chunks (course_id)")
+        # BM25 keyword search over the same rows (external-content FTS5, no text copy)
+        db.execute("CREATE VIRTUAL TABLE chunks_fts USING fts5(text, content='chunks', content_rowid='id')")
+        db.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        db.commit()
+
+        info = {
+            "backend": backend,
+            "lectures": len(lectures),
+            "chunks": next_id,
+            "build_seconds": round(time.perf_counter() - start, 2),
+            "built_at": time.time(),
+        }
+        tmp_index = os.path.join(LIBRARY_DIR, f"index.{uuid.uuid4().hex}.tmp")
+        faiss.write_index(index, tmp_index)
+        with self.lock:
+            if self.db:
+                self.db.close()
+            db.close()
+            os.replace(tmp_index, os.path.join(LIBRARY_DIR, "index.faiss"))
+            os.replace(tmp_db, os.path.join(LIBRARY_DIR, "chunks.sqlite"))
+            with open(os.path.join(LIBRARY_DIR, "info.json"), "w") as f:
+                json.dump(info, f)
+            self._open()
+        print(f"📚 Library index built: {info}")
+        return info
+
+    @staticmethod
+    def _filter(lecture_ids, course_ids):
+        """SQL condition on chunks for the requested lectures/courses, or None for everything."""
+        clauses, args = [], []
+        for column, values in (("lecture_id", lecture_ids), ("course_id", course_ids)):
+            if values:
+                clauses.append(f"chunks.{column} IN ({','.join('?' * len(values))})")
+                args.extend(values)
+        return (f"({' OR '.join(clauses)})", args) if clauses else (None, [])
+
+    def search(self, question, k=3, lecture_ids=None, course_ids=None, nprobe=RAG_ANN_NPROBE, ef_search=RAG_ANN_EF_SEARCH,
+               refine=RAG_ANN_REFINE):
+        with self.lock:
+            if self.index is None:
+                return []
+            allowed = None
+            condition, args = self._filter(lecture_ids, course_ids)
+            if condition:
+                rows = self.db.execute(f"SELECT id FROM chunks WHERE {condition}", args).fetchall()
+                allowed = np.array([r[0] for r in rows], dtype=np.int64)
+                if not len(allowed):
+                    return []
+
+            query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+            params = ann_index.search_params(self.index, nprobe, ef_search, allowed, refine)
+            _, ids = ann_index.search(self.index, query, k, params)
+            ids = [int(i) for i in ids[0] if i != -1]
+            if not ids:
+                return []
+            rows = self.db.execute(
+                f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        by_id = {r[0]: Document(page_content=r[1], metadata=json.loads(r[2])) for r in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def keyword_search(self, question, k=3, lecture_ids=None, course_ids=None):
+        """BM25 hits from the FTS5 table; empty for libraries built before it existed."""
+        words = set(retrieval.terms(question))
+        with self.lock:
+            if self.index is None or not words:
+                return []
+            condition, args = self._filter(lecture_ids, course_ids)
+            try:
+                rows = self.db.execute(
+                    "SELECT chunks.text, chunks.metadata FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid"
+                    f" WHERE chunks_fts MATCH ?{f' AND {condition}' if condition else ''}"
+                    " ORDER BY bm25(chunks_fts) LIMIT ?",
+                    [" OR ".join(f'"{w}"' for w in words), *args, k],
+                ).fetchall()
+            except sqlite3.OperationalError:
+                return []
+        return [Document(page_content=text, metadata=json.loads(metadata)) for text, metadata in rows]
+
+    def describe(self):
+        with self.lock:
+            return {**self.info, "loaded": self.index is not None}
+
+# --------------------
+# RAG Retrieval (hybrid BM25 + dense, rerank, token-budget packing)
+# --------------------
+# Dense FAISS hits and BM25 keyword hits are fused by reciprocal rank, so exact
+# terms (formula names, acronyms) are found even when their embedding is not
+# close. The fused candidates are optionally reranked by a cross-encoder and
+# packed into RAG_CONTEXT_TOKENS of prompt, with overlapping chunk edges merged.
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "20"))
+RAG_MAX_PASSAGES = int(os.getenv("RAG_MAX_PASSAGES", "6"))
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "384"))
+RAG_RERANKER = os.getenv("RAG_RERANKER", "")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2; empty = off
+RAG_RERANK_MIN_SCORE = float(os.getenv("RAG_RERANK_MIN_SCORE", "-inf"))
+
+def load_reranker():
+    from sentence_transformers import CrossEncoder
+    model = CrossEncoder(RAG_RERANKER, device="cpu")
+    return model, torch_bytes(model.model)
+
+if RAG_RERANKER:
+    model_manager.register("reranker", load_reranker, 100)
+
+def chunk_key(doc):
+    return (doc.metadata.get("lecture_id"), doc.metadata.get("chunk_id") or content_key(doc.page_content)[:32])
+
+def chunk_position(doc):
+    """(lecture, chunk number) so packed passages read in transcript order."""
+    number = re.search(r"\d+", doc.metadata.get("source", ""))
+    return (doc.metadata.get("lecture_id") or "", int(number.group()) if number else 0)
+
+def count_tokens(text):
+    return len(tokenizer(text, add_special_tokens=False).input_ids)
 
 # --------------------
 # CLASS: Lecture Doubt Solver
@@ -113,46 +1622,140 @@ def generate_llm(messages, max_new_tokens=1024, temperature=0.7):
 class LectureDoubtSolver:
     def __init__(self):
         print("🚀 Initializing RAG Engine...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        self.vector_store = None
-        self.retriever = None
-
-    def process_lecture_data(self, transcript_text):
-        """Indexes the transcript into FAISS"""
-        if not transcript_text.strip():
-            return False
+        self.embeddings = EmbeddingService()
+        self.registry = IndexRegistry(self.embeddings)
+        self.library = LibraryIndex(self.registry, self.embeddings)
 
+    def split(self, text, lecture_id, start=0, page=None, course_id=None):
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=600,
             chunk_overlap=100
         )
-        chunks = splitter.split_text(transcript_text)
-        
-        docs = [
-            Document(page_content=c, metadata={"source": f"Chunk {i+1}"})
+        chunks = splitter.split_text(text)
+        metadata = {"lecture_id": lecture_id}
+        if page is not None:
+            metadata["page"] = page
+        if course_id is not None:
+            metadata["course_id"] = course_id
+        return [
+            Document(page_content=c, metadata={**metadata, "source": f"Chunk {start+i+1}", "chunk_id": content_key(c)[:32]})
             for i, c in enumerate(chunks)
         ]
 
-        self.vector_store = FAISS.from_documents(docs, self.embeddings)
-        self.retriever = self.vector_store.as_retriever(search_kwargs={"k": 3})
+    def process_lecture_data(self, transcript_text, lecture_id, course_id=None):
+        """Indexes the transcript into its own FAISS index"""
+        if not transcript_text.strip():
+            return False
+
+        self.index_docs(self.split(transcript_text, lecture_id, course_id=course_id), lecture_id)
         return True
 
-    def ask_doubt(self, question):
-        """Retrieves context and asks the LLM"""
-        if not self.retriever:
-            return "⚠️ No lecture has been indexed yet. Please upload/transcribe a file first."
+    def index_docs(self, docs, lecture_id):
+        """Makes the lecture's index hold exactly these chunks and persists it."""
+        self.registry.sync(lecture_id, docs)
+        self.registry.save(lecture_id)
+
+    def begin_lecture(self, lecture_id):
+        """Clears the lecture's index before a streamed transcript starts arriving."""
+        self.registry.drop(lecture_id)
+
+    def add_transcript(self, text, lecture_id):
+        """Appends a piece of a streamed transcript to the lecture's index"""
+        if not text.strip():
+            return False
+
+        entry = self.registry.get(lecture_id)
+        start = entry.store.index.ntotal if entry else 0
+        self.registry.add(lecture_id, self.split(text, lecture_id, start))
+        return True
 
-        docs = self.retriever.invoke(question)
-        context_text = "\n\n".join([d.page_content for d in docs])
+    def split_pages(self, pages, lecture_id, start=0, course_id=None):
+        """Chunks (page_number, text) pairs, keeping the page number on every chunk"""
+        docs = []
+        for page, text in pages:
+            docs.extend(self.split(text, lecture_id, start + len(docs), page, course_id))
+        return docs
+
+    def add_pages(self, pages, lecture_id):
+        """Indexes (page_number, text) pairs, keeping the page number on every chunk"""
+        entry = self.registry.get(lecture_id)
+        docs = self.split_pages(pages, lecture_id, entry.store.index.ntotal if entry else 0)
+        if docs:
+            self.registry.add(lecture_id, docs)
+        return bool(docs)
+
+    def has_lecture(self, lecture_id):
+        return self.registry.get(lecture_id) is not None
+
+    def finish_lecture(self, lecture_id):
+        self.registry.save(lecture_id)
+
+    @staticmethod
+    def fuse(*rankings):
+        """Reciprocal rank fusion of ranked Document lists, deduplicated by chunk."""
+        docs = {}
+        for ranking in rankings:
+            for d in ranking:
+                docs.setdefault(chunk_key(d), d)
+        return [docs[key] for key in retrieval.fuse([[chunk_key(d) for d in r] for r in rankings])]
+
+    def retrieve(self, question, lecture_ids, k=RAG_CANDIDATES):
+        """Top-k dense and top-k BM25 chunks across the lectures, fused by rank."""
+        query = self.embeddings.embed_query(question)
+        dense, sparse = [], []
+        for lecture_id in lecture_ids:
+            entry = self.registry.get(lecture_id)
+            if entry:
+                dense.extend(entry.store.similarity_search_with_score_by_vector(query, k=k))
+                bm25, docs = entry.keyword_index()
+                sparse.extend((docs[i], score) for i, score in bm25.search(question, k))
+        dense.sort(key=lambda h: h[1])
+        sparse.sort(key=lambda h: -h[1])
+        return self.fuse([d for d, _ in dense[:k]], [d for d, _ in sparse[:k]])
+
+    def rerank(self, question, docs):
+        """Cross-encoder order (when RAG_RERANKER is set), dropping hits under RAG_RERANK_MIN_SCORE."""
+        if not RAG_RERANKER or len(docs) < 2:
+            return docs
+        with model_manager.use("reranker") as model, tracer.span("rag_rerank", candidates=len(docs)):
+            scores = model.predict([(question, d.page_content) for d in docs])
+        ranked = sorted(zip(scores, docs), key=lambda p: -p[0])
+        return [d for score, d in ranked if score >= RAG_RERANK_MIN_SCORE] or [ranked[0][1]]
+
+    def build_context(self, question, lecture_id=None, lecture_ids=None, course_ids=None, scope="lecture"):
+        """Hybrid retrieval, rerank and packing; returns the prompt context or None."""
+        with tracer.span("rag_retrieve", scope=scope) as span:
+            if scope == "library":
+                ids = lecture_ids or ([lecture_id] if lecture_id else None)
+                docs = self.fuse(
+                    self.library.search(question, k=RAG_CANDIDATES, lecture_ids=ids, course_ids=course_ids),
+                    self.library.keyword_search(question, k=RAG_CANDIDATES, lecture_ids=ids, course_ids=course_ids),
+                )
+            else:
+                lecture_ids = lecture_ids or [lecture_id]
+                docs = self.retrieve(question, [l for l in lecture_ids if l])
+            if not docs:
+                return None
+            docs = self.rerank(question, docs)
+            context, used, tokens = retrieval.pack(
+                [(chunk_position(d), d.page_content) for d in docs],
+                RAG_CONTEXT_TOKENS, count_tokens, RAG_MAX_PASSAGES,
+            )
+            span.update(candidates=len(docs), passages=used, context_tokens=tokens)
+        return context
+
+    def ask_doubt(self, question, lecture_id=None, lecture_ids=None, course_ids=None, scope="lecture", stream=None):
+        """Retrieves context and asks the LLM"""
+        context_text = self.build_context(question, lecture_id, lecture_ids, course_ids, scope)
+        if context_text is None:
+            return "⚠️ Nothing is indexed for this lecture yet. Please upload/transcribe a file first."
 
         messages = [
             {"role": "system", "content": "You are a helpful Academic Assistant. Use ONLY the provided lecture context to answer. If the answer is not in the lecture, say you don't know."},
             {"role": "user", "content": f"Context:\n{context_text}\n\nQuestion:\n{question}"}
         ]
 
-        answer = generate_llm(messages, max_new_tokens=512, temperature=0.3)
+        answer = generate_llm(messages, max_new_tokens=512, temperature=0.3, stream=stream, endpoint="rag")
         return answer
 
 # Initialize Global Solver Instance
@@ -170,195 +1773,567 @@ DOT_HEADER = """digraph G {
 """
 
 # --------------------
-# Helper: Diagram Generation Logic (Graphviz)
+# Diagram Render Service
 # --------------------
-def generate_diagram(text_content, file_id):
-    print("🎨 Generating Diagram...")
-    concepts = generate_llm([
-        {"role": "system", "content": "Extract 8 key concepts and their relationships from these notes."},
-        {"role": "user", "content": text_content[:4000]}
-    ], max_new_tokens=256)
-
-    system_prompt = """
-    You are a Graphviz expert. Output ONLY the raw DOT code.
-    Rules:
-    1. Start with 'digraph G {'
-    2. End with '}'
-    3. Edges must use '->'
-    4. Labels must be double-quoted (e.g. label="text").
-    5. NO Markdown, NO triple quotes, NO comments.
-    """
-    
-    dot_code = None
-    for attempt in range(3):
+# DOT is rendered into tmp/diagrams/<content hash>.<format>, so identical
+# diagrams are rendered once and concurrent requests never overwrite each
+# other. Renders run off the request path with bounded concurrency and a
+# timeout; old or excess artifacts are swept by a background thread.
+# The timeout is only hard for the `dot` subprocess, which is killed. An
+# in-process pygraphviz layout cannot be interrupted, so once one overruns,
+# renders go to the subprocess until that layout returns.
+RENDER_DIR = os.path.join("tmp", "diagrams")
+RENDER_FORMATS = ("png", "svg")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", "20"))
+RENDER_TTL_SECONDS = int(os.getenv("RENDER_TTL_SECONDS", str(7 * 24 * 3600)))
+RENDER_MAX_MB = int(os.getenv("RENDER_MAX_MB", "256"))
+RENDER_SWEEP_SECONDS = int(os.getenv("RENDER_SWEEP_SECONDS", "600"))
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://127.0.0.1:8000")
+
+try:
+    import pygraphviz  # in-process libgvc, no fork per render
+except ImportError:
+    pygraphviz = None
+
+class RenderService:
+    def __init__(self, root=RENDER_DIR, workers=RENDER_WORKERS, timeout=RENDER_TIMEOUT_SECONDS):
+        self.root = root
+        self.workers = workers
+        self.timeout = timeout
+        self.loop = None
+        self.slots = None
+        self.inflight = {}
+        # libgvc is not thread-safe: in-process renders go through one thread
+        self.gvc = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gvc") if pygraphviz else None
+        self.gvc_overrun = None  # future of an in-process layout that outlived its timeout
+        self.stats = {"rendered": 0, "cache_hits": 0, "timeouts": 0, "errors": 0, "swept": 0}
+        os.makedirs(self.root, exist_ok=True)
+
+    def bind(self, loop):
+        self.loop = loop
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def path(self, dot, fmt):
+        return os.path.join(self.root, f"{content_key('render', dot, fmt)[:32]}.{fmt}")
+
+    def url(self, path):
+        return f"{PUBLIC_BASE_URL}/{path}"
+
+    async def render(self, dot, fmt="png"):
+        """URL of the rendered diagram, or None when Graphviz fails or times out."""
+        path = self.path(dot, fmt)
         try:
-            raw = generate_llm([
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create a simple diagram for: {concepts}"}
-            ], temperature=0.2)
-            
-            # --- Aggressive Cleanup ---
-            raw_clean = re.sub(r"'{3,}", "", raw)
-            raw_clean = re.sub(r'"{3,}', "", raw_clean)
-            raw_clean = raw_clean.replace("```dot", "").replace("```", "")
-            
-            lines = raw_clean.splitlines()
-            valid_lines = []
-            for line in lines:
-                s = line.strip()
-                if s.startswith("dot_code") or s.startswith("print("): continue
-                valid_lines.append(line)
-            raw_clean = "\n".join(valid_lines)
-
-            start = raw_clean.find("digraph")
-            end = raw_clean.rfind("}")
-            
-            if start != -1 and end != -1 and end > start:
-                candidate = raw_clean[start:end+1]
-                if "{" not in candidate: candidate = candidate.replace("digraph G", "digraph G {")
-                
-                # --- APPLY DOT_HEADER HERE ---
-                if "nodesep" not in candidate and "{" in candidate:
-                    parts = candidate.split("{", 1)
-                    if len(parts) == 2: candidate = DOT_HEADER + parts[1]
-                
-                if "->" not in candidate and "--" in candidate:
-                     candidate = candidate.replace("--", "->")
-
-                dot_code = candidate
-                break
-            else:
-                print(f"   ⚠️ Attempt {attempt+1}: Invalid DOT syntax.")
-        except Exception as e:
-            print(f"   ⚠️ Retry {attempt+1}: {e}")
-
-    # Render Image
-    image_url = None
-    if dot_code:
-        os.makedirs("tmp", exist_ok=True)
-        dot_path = f"tmp/{file_id}.dot"
-        png_path = f"tmp/{file_id}.png"
-        with open(dot_path, "w") as f:
-            f.write(dot_code)
-        
+            os.utime(path)
+            self.stats["cache_hits"] += 1
+            return self.url(path)
+        except OSError:
+            pass  # not rendered yet, or swept since: render it
+        if path in self.inflight:
+            return await asyncio.shield(self.inflight[path])
+
+        self.inflight[path] = done = asyncio.get_running_loop().create_future()
+        url = None
         try:
-            subprocess.run(["dot", "-Tpng", dot_path, "-o", png_path], check=True, stderr=subprocess.PIPE)
-            image_url = f"http://127.0.0.1:8000/{png_path}"
-        except subprocess.CalledProcessError as e:
-            print(f"   ❌ Graphviz Syntax Error: {e.stderr.decode()}")
+            async with self.slots:
+                with tracer.span("render", format=fmt, backend="pygraphviz" if self.in_process() else "dot"):
+                    data = await asyncio.wait_for(self._render_bytes(dot, fmt), self.timeout)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.stats["rendered"] += 1
+            url = self.url(path)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            print(f"   ❌ Graphviz timed out after {self.timeout:.0f}s")
         except Exception as e:
+            self.stats["errors"] += 1
             print(f"   ❌ Graphviz failed: {e}")
-            
-    return image_url
+        finally:
+            del self.inflight[path]
+            done.set_result(url)
+        return url
+
+    def in_process(self):
+        """pygraphviz is used unless missing or still stuck on an overrun layout."""
+        return self.gvc is not None and (self.gvc_overrun is None or self.gvc_overrun.done())
+
+    async def _render_bytes(self, dot, fmt):
+        if self.in_process():
+            future = self.gvc.submit(lambda: pygraphviz.AGraph(string=dot).draw(format=fmt, prog="dot"))
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # Timed out: the layout keeps the gvc thread until it returns
+                self.gvc_overrun = future
+                raise
+
+        proc = await asyncio.create_subprocess_exec(
+            "dot", f"-T{fmt}",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            out, err = await proc.communicate(dot.encode())
+        except asyncio.CancelledError:
+            # Timed out: don't leave the dot process running
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise RuntimeError(err.decode().strip())
+        return out
+
+    def render_sync(self, dot, fmt="png"):
+        """For job threads: runs render() on the server loop and waits for it."""
+        if self.loop is None:
+            raise RuntimeError("Render service is not bound to the server event loop yet.")
+        return asyncio.run_coroutine_threadsafe(self.render(dot, fmt), self.loop).result()
+
+    def sweep(self, now=None):
+        """Drops artifacts past the TTL, then the least recently used beyond the size budget."""
+        now = now or time.time()
+        files = []
+        # tmp/ itself holds uploads in flight and pre-service map_*/yt_* renders
+        legacy = [os.path.join("tmp", n) for n in os.listdir("tmp") if n.endswith((".png", ".dot"))]
+        for path in legacy + [os.path.join(self.root, n) for n in os.listdir(self.root)]:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime < RENDER_TTL_SECONDS and total <= RENDER_MAX_MB * MB:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats["swept"] += 1
+            except OSError:
+                pass
+
+    def sweeper(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"   ⚠️ Diagram sweep failed: {e}")
+            time.sleep(RENDER_SWEEP_SECONDS)
+
+    def describe(self):
+        return {**self.stats, "backend": "pygraphviz" if self.in_process() else "dot", "workers": self.workers, "inflight": len(self.inflight)}
+
+render_service = RenderService()
+threading.Thread(target=render_service.sweeper, name="diagram-sweeper", daemon=True).start()
+
+@app.on_event("startup")
+async def bind_render_service():
+    render_service.bind(asyncio.get_running_loop())
 
 # --------------------
-# Helper: Processing Pipeline
+# Helper: Diagram Generation Logic (Graphviz)
 # --------------------
-def process_full_pipeline(audio_path, file_id, model_size="medium"):
-    # 1. Transcribe
-    print(f"🎤 Stage 1: Transcribing using {model_size} model...")
-    model = get_whisper_model(model_size)
-    
-    segments, info = model.transcribe(audio_path, beam_size=5, language="en")
-    transcript = " ".join([s.text for s in segments]).strip()
+DIAGRAM_PROMPT = """You are a Graphviz expert. Draw a concept map of these notes:
+the 6-10 key concepts as nodes, connected by edges labelled with their relationship in 1-3 words.
+Keep node names short."""
 
-    # --- AUTO-INDEX FOR RAG ---
-    print("🧠 Indexing for RAG...")
-    rag_solver.process_lecture_data(transcript)
-    # --------------------------
+def dot_messages(text_content):
+    return [
+        {"role": "system", "content": DIAGRAM_PROMPT},
+        {"role": "user", "content": text_content[:4000]}
+    ]
 
-    # 2. Generate Lecture Notes
-    print("📝 Stage 2: Generating Notes...")
-    
-    chunks = [transcript[i:i+6000] for i in range(0, len(transcript), 6000)]
-    total_chunks = len(chunks)
-    print(f"   ↳ Found {total_chunks} chunks to process.")
+def generate_dot(text_content):
+    """Asks the LLM for Graphviz DOT code, cached by the notes it was drawn from."""
+    messages = dot_messages(text_content)
+    dot_key = content_key(LLM_ID, "dot", messages)
+    cached = result_cache.get("dot", dot_key)
+    if cached is not None:
+        return cached
+
+    # The grammar writes DOT_HEADER and the closing brace itself; the model only
+    # picks node names, edge labels and when to stop.
+    dot_code = generate_structured(messages, structured.dot_program(DOT_HEADER), temperature=0.2)
+    result_cache.put("dot", dot_key, dot_code)
+    return dot_code
+
+def generate_diagram(text_content, fmt="png"):
+    """Blocking DOT generation + render for job threads; returns the image URL or None."""
+    print("🎨 Generating Diagram...")
+    dot_code = generate_dot(text_content)
+    return render_service.render_sync(dot_code, fmt) if dot_code else None
 
-    chunk_summaries = []
-    
-    for i, chunk in enumerate(chunks):
-        print(f"   ⏳ Processing chunk {i+1}/{total_chunks}...") 
+# --------------------
+# Helper: Map-Reduce Notes Engine
+# --------------------
+NOTES_CHUNK_CHARS = int(os.getenv("NOTES_CHUNK_CHARS", "6000"))
+NOTES_REDUCE_CHARS = int(os.getenv("NOTES_REDUCE_CHARS", "10000"))
+NOTES_PARALLELISM = int(os.getenv("NOTES_PARALLELISM", str(LLM_MAX_BATCH)))
+
+notes_executor = ThreadPoolExecutor(max_workers=NOTES_PARALLELISM, thread_name_prefix="notes")
+
+SUMMARIZE_PROMPT = "Summarize this section into detailed academic markdown notes."
+MERGE_PROMPT = "Merge these summaries into one clean, structured set of Lecture Notes (Markdown). Use Headers, Bullet points, and Bold text."
+
+def summarize_chunk(chunk):
+    key = content_key(LLM_ID, SUMMARIZE_PROMPT, chunk, 512)
+    cached = result_cache.get("chunk_summary", key)
+    if cached is not None:
+        return cached
+    summary = generate_llm([
+        {"role": "system", "content": SUMMARIZE_PROMPT},
+        {"role": "user", "content": chunk}
+    ], max_new_tokens=512, endpoint="notes")
+    result_cache.put("chunk_summary", key, summary)
+    return summary
+
+def merge_summaries(summaries, max_new_tokens=1024, stream=None):
+    key = content_key(LLM_ID, MERGE_PROMPT, summaries, max_new_tokens)
+    cached = result_cache.get("merge", key)
+    if cached is not None:
+        if stream is not None:
+            stream.emit(stream.event, {"text": cached})
+        return cached
+    merged = generate_llm([
+        {"role": "system", "content": MERGE_PROMPT},
+        {"role": "user", "content": "\n\n".join(summaries)}
+    ], max_new_tokens=max_new_tokens, stream=stream, endpoint="notes")
+    result_cache.put("merge", key, merged)
+    return merged
+
+def group_for_reduce(summaries, limit=NOTES_REDUCE_CHARS):
+    """Packs consecutive summaries into groups that fit one merge prompt."""
+    groups, current, size = [], [], 0
+    for s in summaries:
+        if current and size + len(s) > limit:
+            groups.append(current)
+            current, size = [], 0
+        current.append(s)
+        size += len(s)
+    if current:
+        groups.append(current)
+    return groups
+
+def collect_summaries(futures, cancel=None):
+    """Waits for submitted chunk summaries and returns them in chunk order."""
+    total_chunks = len(futures)
+    chunk_summaries = [None] * total_chunks
+    done = 0
+    for future in as_completed(futures):
+        if cancel is not None and cancel.is_set():
+            for f in futures:
+                f.cancel()
+            raise JobCancelled("Client disconnected; notes generation stopped.")
+        i = futures[future]
+        done += 1
         try:
-            summary = generate_llm([
-                {"role": "system", "content": "Summarize this section into detailed academic markdown notes."},
-                {"role": "user", "content": chunk}
-            ], max_new_tokens=512)
-            chunk_summaries.append(summary)
+            chunk_summaries[i] = future.result()
+            print(f"   ⏳ Chunk {i+1} done ({done}/{total_chunks})")
         except Exception as e:
             print(f"   ❌ Error processing chunk {i+1}: {e}")
-
-    merged_notes = "\n\n".join(chunk_summaries)
-    
-    print("   ↳ Finalizing notes...")
-    final_notes = generate_llm([
-        {"role": "system", "content": "Merge these summaries into one clean, structured set of Lecture Notes (Markdown). Use Headers, Bullet points, and Bold text."},
-        {"role": "user", "content": merged_notes[:10000]} 
-    ], max_new_tokens=1024)
-    
-    return {
-        "transcript": transcript,
-        "notes": final_notes,
-        "image_url": None 
-    }
+        job_manager.report(stage="map", chunk=i + 1, done=done, total=total_chunks)
+    return [s for s in chunk_summaries if s]
+
+def reduce_summaries(summaries, stream=None):
+    """Merges summaries as a tree of groups until one set of notes is left; the last merge can be streamed."""
+    if not summaries:
+        return ""
+
+    # Reduce: merge groups level by level so no summary is ever truncated
+    level = 0
+    while True:
+        groups = group_for_reduce(summaries)
+        if len(summaries) > 1 and len(groups) == len(summaries):
+            # Every summary fills the window alone; merge pairwise to keep shrinking
+            groups = [summaries[i:i+2] for i in range(0, len(summaries), 2)]
+        level += 1
+        print(f"   ↳ Reduce level {level}: {len(summaries)} summaries -> {len(groups)}")
+        if len(groups) == 1 and stream is not None:
+            return merge_summaries(groups[0], stream=stream)
+        summaries = list(notes_executor.map(merge_summaries, groups))
+        job_manager.report(stage="reduce", level=level, groups=len(groups))
+        if len(summaries) == 1:
+            return summaries[0]
+
+def generate_notes(transcript, stream=None):
+    """Summarizes chunks concurrently, then merges them as a tree until one set of notes is left."""
+    chunks = [transcript[i:i+NOTES_CHUNK_CHARS] for i in range(0, len(transcript), NOTES_CHUNK_CHARS)]
+    print(f"   ↳ Found {len(chunks)} chunks to process.")
+
+    # Map: chunk summaries run in parallel and land in the batcher together
+    futures = {notes_executor.submit(summarize_chunk, c): i for i, c in enumerate(chunks)}
+    cancel = stream.cancel if stream is not None else None
+    return reduce_summaries(collect_summaries(futures, cancel), stream)
 
 # --------------------
-# Helper: Accurate 35% Summarizer Logic
+# Helper: Processing Pipeline
 # --------------------
-def accurate_35_summarize(text, target_ratio=0.35):
-    """TRUE 35% word coverage extractive summarization"""
-
-    # 1. CLEAN TEXT
-    text = re.sub(r'\s+', ' ', text)
-    sentences = re.split(r'(?<=[\.!?])\s+', text)
-    sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-
-    # 2. DEDUPLICATE
-    unique_sentences = []
-    seen = set()
-    for sent in sentences:
-        h = hash(sent.lower())
-        if h not in seen:
-            unique_sentences.append(sent)
-            seen.add(h)
-    sentences = unique_sentences
-
-    # 3. CALCULATE TARGET WORD COUNT (35% of ORIGINAL)
-    orig_words = len(re.findall(r'\b\w+\b', text))
-    target_words = max(500, int(orig_words * target_ratio))  # 35% words, min 500
+class ChunkBuilder:
+    """Accumulates streamed segment text and cuts chunks near sentence ends."""
+    def __init__(self, size=NOTES_CHUNK_CHARS):
+        self.size = size
+        self.buffer = ""
+
+    def add(self, text):
+        self.buffer += text
+        chunks = []
+        while len(self.buffer) >= self.size:
+            cut = self.buffer.rfind(". ", self.size // 2, self.size)
+            cut = cut + 1 if cut != -1 else self.size
+            chunks.append(self.buffer[:cut].strip())
+            self.buffer = self.buffer[cut:]
+        return chunks
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+def transcript_key(source_key, model_size="medium", beam_size=5, language="en"):
+    model_name = WHISPER_MODELS.get(model_size, WHISPER_MODELS["medium"])
+    return content_key(source_key, model_name, beam_size, language)
 
-    print(f"{len(sentences)} unique sentences")
-    print(f" Target: {target_words:,}/{orig_words:,} words (35%)")
-
-    # 4. SCORE ALL SENTENCES
-    all_words = re.findall(r'\b\w+\b', text.lower())
-    word_freq = Counter(all_words)
+# --------------------
+# Helper: Long-Form Transcription (VAD split + parallel decode)
+# --------------------
+# off: one sequential transcribe() call
+# parallel: split on silence, decode spans across a process pool, stitch in order
+# batched: faster-whisper's BatchedInferencePipeline on the shared model
+LONGFORM_MODE = os.getenv("LONGFORM_MODE", "off")
+LONGFORM_MIN_SECONDS = float(os.getenv("LONGFORM_MIN_SECONDS", "600"))
+LONGFORM_SPAN_SECONDS = float(os.getenv("LONGFORM_SPAN_SECONDS", "60"))
+LONGFORM_WORKERS = int(os.getenv("LONGFORM_WORKERS", "2"))
+LONGFORM_THREADS_PER_WORKER = int(os.getenv("LONGFORM_THREADS_PER_WORKER", "2"))
+LONGFORM_BATCH_SIZE = int(os.getenv("LONGFORM_BATCH_SIZE", "8"))
+
+longform_pools = {}
+longform_pools_lock = threading.Lock()
+
+def get_longform_pool(model_size):
+    if model_size not in WHISPER_MODELS:
+        model_size = "medium"
+    with longform_pools_lock:
+        if model_size not in longform_pools:
+            print(f"📥 Starting {LONGFORM_WORKERS} long-form workers for {model_size.upper()}...")
+            longform_pools[model_size] = ProcessPoolExecutor(
+                max_workers=LONGFORM_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=longform_worker.init_worker,
+                initargs=(WHISPER_MODELS[model_size], LONGFORM_THREADS_PER_WORKER),
+            )
+        return longform_pools[model_size]
+
+def split_on_silence(audio, max_seconds=LONGFORM_SPAN_SECONDS):
+    """Groups VAD speech regions into spans of at most max_seconds, cut at pauses."""
+    speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    limit = int(max_seconds * SAMPLE_RATE)
+    spans = []
+    for region in speech:
+        if spans and region["end"] - spans[-1][0] <= limit:
+            spans[-1][1] = region["end"]
+        else:
+            spans.append([region["start"], region["end"]])
+    return spans
+
+def transcribe_longform(audio, model_size, beam_size=5, language="en"):
+    """Yields segments in order while later spans are still decoding."""
+    if LONGFORM_MODE == "batched":
+        with model_manager.use(whisper_key(model_size)) as model:
+            batched = BatchedInferencePipeline(model=model)
+            segments, _ = batched.transcribe(audio, beam_size=beam_size, language=language, batch_size=LONGFORM_BATCH_SIZE)
+            for seg in segments:
+                yield {"start": seg.start, "end": seg.end, "text": seg.text}
+        return
+
+    spans = split_on_silence(audio)
+    print(f"   ↳ VAD found {len(spans)} speech spans, decoding on {LONGFORM_WORKERS} workers...")
+    pool = get_longform_pool(model_size)
+    futures = [
+        pool.submit(longform_worker.transcribe_span, audio[start:end], start / SAMPLE_RATE, beam_size, language)
+        for start, end in spans
+    ]
+    for i, future in enumerate(futures):
+        yield from future.result()
+        job_manager.report(stage="asr", span=i + 1, total=len(spans))
 
-    scored_sentences = []
-    for sent in sentences:
-        sent_words = re.findall(r'\b\w+\b', sent.lower())
-        score = sum(word_freq[w] * np.log(len(all_words) / word_freq[w])
-                   for w in sent_words if word_freq[w] > 1)
-        word_count = len(sent_words)
-        scored_sentences.append((score, word_count, sent))
+# --------------------
+# Audio Ingestion (ffmpeg pipe -> PCM)
+# --------------------
+# YouTube streams and uploads are piped through ffmpeg straight into 16 kHz mono
+# float32 arrays for Whisper, inside the job and under the asr stage slot, so
+# queued jobs hold no PCM. Awaited routes hand ffmpeg the request's own upload
+# file (no copy); only /jobs/* submissions, which outlive the request, spool
+# the upload to a private file first.
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1 << 20)))
+
+class AudioDecodeError(Exception):
+    pass
+
+def ffmpeg_pcm(input_args, stdin=None):
+    """Runs ffmpeg on the given input; stdin, when set, is a file object it reads from."""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", *input_args,
+        "-vn", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1",
+    ]
+    proc = subprocess.Popen(
+        cmd,
+        stdin=stdin if stdin is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    pcm, err = proc.communicate()
+    if proc.returncode != 0 or not pcm:
+        raise AudioDecodeError(err.decode(errors="replace").strip() or "ffmpeg produced no audio")
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+def decode_file(source):
+    """16 kHz PCM of an upload: a spooled path, or the request's own upload file object."""
+    with tracer.span("ffmpeg", source="file"):
+        try:
+            if isinstance(source, str):
+                return ffmpeg_pcm(["-i", source])
+            # The upload's descriptor becomes ffmpeg's stdin; /dev/stdin (unlike
+            # pipe:0) keeps it seekable, which MP4/M4A with a trailing index need
+            source.seek(0)
+            return ffmpeg_pcm(["-i", "/dev/stdin"], stdin=source)
+        except AudioDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Could not decode audio: {e}")
+
+def youtube_pcm(url, cookie_file=None):
+    """Streams the best audio-only format through ffmpeg: no MP3 re-encode, no temp file."""
+    opts = {"format": "bestaudio/best", "quiet": True, "cookiefile": cookie_file}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    fmt = info["requested_formats"][0] if info.get("requested_formats") else info
+    headers = "".join(f"{k}: {v}\r\n" for k, v in (fmt.get("http_headers") or {}).items())
+    try:
+        return ffmpeg_pcm([*(["-headers", headers] if headers else []), "-i", fmt["url"]])
+    except AudioDecodeError as e:
+        print(f"   ⚠️ Direct stream failed ({e}), downloading the original audio instead")
+
+    # Fallback: keep the source container (still no re-encode) and decode it once
+    name = f"yt_{uuid.uuid4().hex}"
+    with yt_dlp.YoutubeDL({**opts, "outtmpl": os.path.join("tmp", f"{name}.%(ext)s")}) as ydl:
+        ydl.download([url])
+    path = next(os.path.join("tmp", p) for p in os.listdir("tmp") if p.startswith(name))
+    try:
+        return ffmpeg_pcm(["-i", path])
+    finally:
+        os.remove(path)
 
-    # 5. GREEDY SELECTION - highest score until target words reached
-    scored_sentences.sort(key=lambda x: x[0], reverse=True)
-    selected_sentences = []
-    current_word_count = 0
+def whisper_segments(audio, model_size, beam_size=5, language="en"):
+    """In-process Whisper decode; the model stays pinned until the last segment is read."""
+    with model_manager.use(whisper_key(model_size)) as model:
+        raw, _ = model.transcribe(audio, beam_size=beam_size, language=language)
+        for seg in raw:
+            yield {"start": seg.start, "end": seg.end, "text": seg.text}
 
-    for score, word_count, sent in scored_sentences:
-        if current_word_count + word_count <= target_words:
-            selected_sentences.append(sent)
-            current_word_count += word_count
-        if current_word_count >= target_words * 0.9:  # 90% of target
-            break
+def transcribe_segments(audio, model_size, key, beam_size=5, language="en"):
+    """Yields segment dicts as Whisper decodes them, or replays a cached transcript.
 
-    # 6. PRESERVE ORDER
-    order_map = {sent: i for i, sent in enumerate(sentences)}
-    selected_sentences.sort(key=lambda x: order_map[x])
-    summary_text = "\n\n".join(selected_sentences)
+    audio is a 16 kHz float32 array, or an upload (path or file object) that is decoded first.
+    """
+    cached = result_cache.get("transcript", key)
+    if cached is not None:
+        yield from cached["segments"]
+        return
+
+    decoded = []
+    with job_manager.stage("asr"):
+        if not isinstance(audio, np.ndarray):
+            audio = decode_file(audio)
+        duration = len(audio) / SAMPLE_RATE
+        segments = None
+        if LONGFORM_MODE != "off" and duration >= LONGFORM_MIN_SECONDS:
+            segments = transcribe_longform(audio, model_size, beam_size, language)
+        if segments is None:
+            segments = whisper_segments(audio, model_size, beam_size, language)
+
+        # Only time spent inside the decoder counts; the consumer runs between yields
+        decode_seconds, wall = 0.0, time.time()
+        segments = iter(segments)
+        while True:
+            start = time.perf_counter()
+            item = next(segments, None)
+            decode_seconds += time.perf_counter() - start
+            if item is None:
+                break
+            decoded.append(item)
+            yield item
+    AUDIO_SECONDS.labels(model_size).inc(duration)
+    if duration:
+        ASR_RTF.labels(model_size).observe(decode_seconds / duration)
+    tracer.record("asr", decode_seconds, wall, model_size=model_size, audio_seconds=round(duration, 2), segments=len(decoded))
+    result_cache.put("transcript", key, {"segments": decoded})
+
+def process_full_pipeline(audio, file_id, model_size="medium", emit=None, source_key=None):
+    """Transcribes while chunks are indexed and summarized as soon as they fill up."""
+    stream = TokenStream(emit, job_manager.cancel_event(), event="notes_token") if emit else None
+    emit = emit or (lambda event, data: None)
+    cancel = job_manager.cancel_event()
+    key = transcript_key(source_key or file_digest(audio), model_size)
+    lecture_id = f"lec_{key[:16]}"
+    notes_key = content_key(key, LLM_ID, NOTES_CHUNK_CHARS, NOTES_REDUCE_CHARS)
+    cached_notes = result_cache.get("notes", notes_key)
+    needs_index = not rag_solver.has_lecture(lecture_id)
+
+    # 1. Transcribe (streaming)
+    print(f"🎤 Stage 1: Transcribing using {model_size} model...")
+    builder = ChunkBuilder()
+    texts, chunks, futures = [], [], {}
+    if needs_index:
+        rag_solver.begin_lecture(lecture_id)
+
+    def dispatch(chunk):
+        index = len(chunks)
+        chunks.append(chunk)
+        print(f"   ⏳ Chunk {index+1} ready, indexing + summarizing...")
+        if needs_index:
+            rag_solver.add_transcript(chunk, lecture_id)
+        if cached_notes is not None:
+            return
+        future = notes_executor.submit(summarize_chunk, chunk)
+        future.add_done_callback(
+            lambda f: emit("chunk_summary", {"index": index, "summary": f.result()}) if not f.exception() else None
+        )
+        futures[future] = index
+
+    for seg in transcribe_segments(audio, model_size, key):
+        if cancel.is_set():
+            # A half-built index would look complete to the next request
+            if needs_index:
+                rag_solver.registry.drop(lecture_id)
+            for f in futures:
+                f.cancel()
+            raise JobCancelled("Client disconnected; transcription stopped.")
+        texts.append(seg["text"])
+        emit("segment", seg)
+        for chunk in builder.add(seg["text"]):
+            dispatch(chunk)
+    for chunk in builder.flush():
+        dispatch(chunk)
+
+    if needs_index:
+        rag_solver.finish_lecture(lecture_id)
+    transcript = " ".join(texts).strip()
+    emit("transcript", {"text": transcript})
 
-    return summary_text, orig_words, current_word_count
+    # 2. Generate Lecture Notes
+    print("📝 Stage 2: Generating Notes...")
+    if cached_notes is not None:
+        final_notes = cached_notes
+    else:
+        final_notes = reduce_summaries(collect_summaries(futures, cancel), stream)
+        result_cache.put("notes", notes_key, final_notes)
+    emit("notes", {"notes": final_notes})
+    
+    return {
+        "transcript": transcript,
+        "notes": final_notes,
+        "image_url": None,
+        "lecture_id": lecture_id
+    }
 
 # --------------------
 # Routes
@@ -366,39 +2341,67 @@ def accurate_35_summarize(text, target_ratio=0.35):
 
 class RagQuery(BaseModel):
     question: str
+    lecture_id: Optional[str] = None
+    lecture_ids: Optional[List[str]] = None
+    course_ids: Optional[List[str]] = None
+    scope: str = "lecture"  # lecture | library
 
 class RagIngest(BaseModel):
     text: str
+    lecture_id: Optional[str] = None  # a new one is generated and returned when omitted
+    course_id: Optional[str] = None
+
+class LibraryBuild(BaseModel):
+    backend: str = RAG_ANN_BACKEND
+
+class LibrarySearch(BaseModel):
+    question: str
+    k: int = 5
+    lecture_ids: Optional[List[str]] = None
+    course_ids: Optional[List[str]] = None
+    nprobe: int = RAG_ANN_NPROBE
+    ef_search: int = RAG_ANN_EF_SEARCH
+    refine: int = RAG_ANN_REFINE
+
+# Each question is ~350 forced/sampled tokens and holds the LLM slot throughout
+QUIZ_MAX_QUESTIONS = int(os.getenv("QUIZ_MAX_QUESTIONS", "10"))
 
 class QuizRequest(BaseModel):
     note_content: str
-    num_questions: int = 3
+    num_questions: int = Field(3, ge=1, le=QUIZ_MAX_QUESTIONS)
     
 class MindMapRequest(BaseModel):
     note_content: str
+    format: str = "png"  # png | svg
 
-@app.post("/rag/ingest")
-async def rag_ingest(item: RagIngest):
-    success = rag_solver.process_lecture_data(item.text)
+def check_rag_query(item: RagQuery):
+    """Lecture-scoped questions must name their lecture(s); there is no shared default."""
+    if item.scope != "library" and not (item.lecture_id or item.lecture_ids):
+        raise HTTPException(status_code=400, detail="lecture_id (or lecture_ids) is required; use the id returned by /rag/ingest.")
+
+def rag_ingest_task(item: RagIngest):
+    lecture_id = item.lecture_id or f"note_{uuid.uuid4().hex[:16]}"
+    success = rag_solver.process_lecture_data(item.text, lecture_id, item.course_id)
     if success:
-        return {"status": "success", "message": "Text indexed successfully."}
+        return {"status": "success", "message": "Text indexed successfully.", "lecture_id": lecture_id}
     else:
         raise HTTPException(status_code=400, detail="Empty text provided.")
 
-@app.post("/rag/query")
-async def rag_query(item: RagQuery):
-    answer = rag_solver.ask_doubt(item.question)
+def rag_query_task(item: RagQuery):
+    answer = rag_solver.ask_doubt(item.question, item.lecture_id, item.lecture_ids, item.course_ids, item.scope)
     return {"answer": answer}
 
-@app.post("/generate_quiz")
-async def generate_quiz(item: QuizRequest):
-    if not item.note_content.strip():
-        raise HTTPException(status_code=400, detail="Note content is empty.")
+@app.post("/rag/ingest")
+async def rag_ingest(item: RagIngest):
+    return await run_job("rag_ingest", rag_ingest_task, item)
 
-    context_chunk = item.note_content[:5000]
+@app.post("/rag/query")
+async def rag_query(item: RagQuery):
+    check_rag_query(item)
+    return await run_job("rag_query", rag_query_task, item)
 
-    # --- REVERTED TO 1.5B LOGIC (Separated Answers & Distractors) ---
-    print(f"🧠 Generating {item.num_questions} questions using 1.5B model logic...")
+def quiz_messages(item: QuizRequest):
+    context_chunk = item.note_content[:5000]
 
     system_prompt = """You are an expert academic evaluator. Create high-quality, challenging multiple-choice questions based ONLY on the provided text.
     Rules:
@@ -419,63 +2422,143 @@ async def generate_quiz(item: QuizRequest):
     "{context_chunk}"
     Return the JSON list ONLY."""
 
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
 
-    try:
-        response_text = generate_llm(messages, max_new_tokens=1024, temperature=0.3)
+def format_quiz(quiz_data):
+    """Shuffles each question's options and records the index of the correct one."""
+    final_quiz = []
+    for q in quiz_data:
+        if "correct_answer" not in q or "distractors" not in q: continue
         
-        clean_json = re.sub(r'```json\s*|\s*```', '', response_text).strip()
-        match = re.search(r'\[.*\]', clean_json, re.DOTALL)
-        if match: clean_json = match.group(0)
+        correct_txt = q["correct_answer"].strip()
+        distractors = q["distractors"]
+        if not isinstance(distractors, list): continue
+        distractors = [str(d).strip() for d in distractors]
+        all_options = [correct_txt] + distractors
+        random.shuffle(all_options)
         
-        quiz_data = json.loads(clean_json)
-
-        final_quiz = []
-        for q in quiz_data:
-            if "correct_answer" not in q or "distractors" not in q: continue
-            
-            correct_txt = q["correct_answer"].strip()
-            distractors = q["distractors"]
-            if not isinstance(distractors, list): continue
-            distractors = [str(d).strip() for d in distractors]
-            all_options = [correct_txt] + distractors
-            random.shuffle(all_options)
-            
-            try:
-                correct_index = all_options.index(correct_txt)
-            except ValueError:
-                correct_index = 0
-            
-            final_q = {
-                "question": q.get("question", "Unknown Question"),
-                "options": all_options,
-                "answer": correct_index,
-                "explanation": q.get("explanation", "")
-            }
-            final_quiz.append(final_q)
+        try:
+            correct_index = all_options.index(correct_txt)
+        except ValueError:
+            correct_index = 0
+        
+        final_q = {
+            "question": q.get("question", "Unknown Question"),
+            "options": all_options,
+            "answer": correct_index,
+            "explanation": q.get("explanation", "")
+        }
+        final_quiz.append(final_q)
+    return final_quiz
+
+def quiz_task(item: QuizRequest, emit=None):
+    if not item.note_content.strip():
+        raise HTTPException(status_code=400, detail="Note content is empty.")
+
+    # --- REVERTED TO 1.5B LOGIC (Separated Answers & Distractors) ---
+    print(f"🧠 Generating {item.num_questions} questions using 1.5B model logic...")
+
+    messages = quiz_messages(item)
+
+    quiz_key = content_key(LLM_ID, messages)
+    cached = result_cache.get("quiz", quiz_key)
+    if cached is not None:
+        return {"quiz": cached}
+
+    stream = TokenStream(emit, job_manager.cancel_event()) if emit else None
+    try:
+        quiz_data = generate_structured(messages, structured.quiz_program(item.num_questions), temperature=0.3, stream=stream)
 
+        final_quiz = format_quiz(quiz_data)
+        if final_quiz:
+            result_cache.put("quiz", quiz_key, final_quiz)
+        if stream is not None:
+            return {"quiz": final_quiz, "stream": stream.stats()}
         return {"quiz": final_quiz}
 
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"❌ Quiz Error: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate quiz.")
 
-@app.post("/generate_mindmap")
-async def generate_mindmap(item: MindMapRequest):
+@app.get("/models")
+async def models_overview():
+    return model_manager.stats()
+
+@app.get("/llm/assist")
+async def llm_assist():
+    return {"config": LLM_ASSIST, "draft_model": LLM_DRAFT_ID, "modes": assist_stats.describe()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**result_cache.stats(), "prefix_kv": prefix_cache.stats()}
+
+@app.get("/rag/indexes")
+async def rag_indexes():
+    return rag_solver.registry.describe()
+
+@app.post("/rag/library/build", status_code=202)
+async def rag_library_build(item: LibraryBuild):
+    if item.backend not in ann_index.BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend must be one of {list(ann_index.BACKENDS)}")
+    return submit_job("library_build", rag_solver.library.build, item.backend)
+
+@app.get("/rag/library")
+async def rag_library():
+    return rag_solver.library.describe()
+
+def library_search_task(item: LibrarySearch):
+    start = time.perf_counter()
+    docs = rag_solver.library.search(item.question, item.k, item.lecture_ids, item.course_ids, item.nprobe, item.ef_search, item.refine)
+    return {
+        "chunks": [{"text": d.page_content, "metadata": d.metadata} for d in docs],
+        "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+@app.post("/rag/library/search")
+async def rag_library_search(item: LibrarySearch):
+    return await run_job("library_search", library_search_task, item)
+
+@app.get("/rag/embeddings")
+async def rag_embeddings():
+    return rag_solver.embeddings.describe()
+
+@app.post("/generate_quiz")
+async def generate_quiz(item: QuizRequest):
+    return await run_job("generate_quiz", quiz_task, item)
+
+def check_mindmap(item: MindMapRequest):
     if not item.note_content.strip():
          raise HTTPException(status_code=400, detail="Note content is empty.")
-    
-    file_id = f"map_{int(time.time())}"
-    image_url = generate_diagram(item.note_content, file_id)
+    if item.format not in RENDER_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(RENDER_FORMATS)}")
+
+def mindmap_task(item: MindMapRequest):
+    image_url = generate_diagram(item.note_content, item.format)
     
     if not image_url:
         raise HTTPException(status_code=500, detail="Failed to generate mind map.")
         
     return {"image_url": image_url}
 
+@app.post("/generate_mindmap")
+async def generate_mindmap(item: MindMapRequest):
+    check_mindmap(item)
+    # The LLM part holds a job worker; rendering is awaited on the event loop
+    dot_code = await run_job("generate_mindmap", generate_dot, item.note_content)
+    image_url = await render_service.render(dot_code, item.format) if dot_code else None
+    if not image_url:
+        raise HTTPException(status_code=500, detail="Failed to generate mind map.")
+    return {"image_url": image_url}
+
+@app.get("/diagrams/stats")
+async def diagram_stats():
+    return render_service.describe()
+
 @app.post("/upload_cookies")
 async def upload_cookies(file: UploadFile):
     try:
@@ -486,135 +2569,722 @@ async def upload_cookies(file: UploadFile):
     except Exception as e:
         return {"error": str(e)}
 
-@app.post("/youtube_summarize")
-async def youtube_summarize(item: dict):
+def youtube_task(item: dict, emit=None):
     url = item.get("url")
     model_size = item.get("model_size", "medium") # Read model size
 
     if not url: return {"error": "No URL provided"}
 
-    output_folder = "tmp"
-    os.makedirs(output_folder, exist_ok=True)
-    file_id = f"yt_{int(time.time())}"
+    os.makedirs("tmp", exist_ok=True)
+    file_id = f"yt_{uuid.uuid4().hex[:8]}"
     cookie_file = "cookies.txt" if os.path.exists("cookies.txt") else None
-    
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': f'{output_folder}/{file_id}.%(ext)s',
-        'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}],
-        'quiet': True,
-        'cookiefile': cookie_file
-    }
 
     try:
-        print(f"Downloading: {url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        source_key = f"url:{url}"
+        audio = None
+        if result_cache.has("transcript", transcript_key(source_key, model_size)):
+            print(f"⚡ Transcript cached, skipping download: {url}")
+        else:
+            print(f"Downloading: {url}")
+            with job_manager.stage("download"), tracer.span("download"):
+                audio = youtube_pcm(url, cookie_file)
         
-        audio_path = f"{output_folder}/{file_id}.mp3"
-        result = process_full_pipeline(audio_path, file_id, model_size)
-        
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-            
-        return result
+        return process_full_pipeline(audio, file_id, model_size, emit, source_key)
 
     except Exception as e:
         print(f"Error: {e}")
         return {"error": str(e)}
 
-@app.post("/pdf_summarize")
-async def pdf_summarize(file: UploadFile):
+@app.post("/youtube_summarize")
+async def youtube_summarize(item: dict):
+    return await run_job("youtube_summarize", youtube_task, item)
+
+def save_upload(file: UploadFile):
+    """Streams the upload to a private path in chunks, hashing as it writes; returns (path, sha256)."""
     os.makedirs("./tmp", exist_ok=True)
-    file_path = f"./tmp/{file.filename}"
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    path = f"./tmp/up_{uuid.uuid4().hex}{os.path.splitext(file.filename or '')[1]}"
+    h = hashlib.sha256()
+    with open(path, "wb") as f:
+        for block in iter(lambda: file.file.read(UPLOAD_CHUNK_BYTES), b""):
+            h.update(block)
+            f.write(block)
+    return path, h.hexdigest()
+
+# --------------------
+# Helper: PDF Extraction (single pass, parallel pages)
+# --------------------
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "4"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_INDEX_BATCH_PAGES = int(os.getenv("PDF_INDEX_BATCH_PAGES", "16"))
+
+pdf_pool = None
+pdf_pool_lock = threading.Lock()
+
+def get_pdf_pool():
+    global pdf_pool
+    # Bulk extraction calls this from several threads; only one may create the pool
+    with pdf_pool_lock:
+        if pdf_pool is None:
+            pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return pdf_pool
+
+def iter_pdf_pages(path):
+    """Yields (page_number, text) in page order; big documents fan out to worker processes."""
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+        if page_count < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+            for i, page in enumerate(doc):
+                yield i + 1, page.get_text()
+            return
+
+    # A few ranges per worker keeps the pool busy when some pages are heavier
+    step = max(1, -(-page_count // (PDF_WORKERS * 4)))
+    starts = list(range(0, page_count, step))
+    ends = [min(s + step, page_count) for s in starts]
+    for pages in get_pdf_pool().map(pdf_worker.extract_pages, itertools.repeat(path, len(starts)), starts, ends):
+        yield from pages
+
+def pdf_task(file_path, filename, method="tfidf", digest=None):
     try:
-        print(f"🔍 EXTRACTING PDF: {file.filename}")
-        doc = fitz.open(file_path)
-        all_text = ""
-        
-        # Triple extraction for max accuracy
-        for page in doc:
-            text1 = page.get_text()
-            text2 = page.get_text("blocks")
-            text3 = " ".join([block[4] for block in text2 if isinstance(block[4], str)])
-            
-            combined = f"{text1}\n\n{text3}"
-            all_text += combined + "\n\n"
-
-        # Index for RAG
-        rag_solver.process_lecture_data(all_text)
-        
-        # USE THE CUSTOM 35% SUMMARIZER
-        summary_text, orig_count, summary_count = accurate_35_summarize(all_text)
-        
-        # Add Header Metadata
-        final_summary = f"""# PDF Summary Report
+        digest = digest or file_digest(file_path)
+        summary_key = content_key(digest, method)
+        cached = result_cache.get("pdf_summary", summary_key)
+        if cached is not None and rag_solver.has_lecture(cached["lecture_id"]):
+            print(f"⚡ PDF summary cached: {filename}")
+            return cached
+
+        print(f"🔍 EXTRACTING PDF: {filename}")
+        lecture_id = f"pdf_{digest[:16]}"
+        index_needed = not rag_solver.has_lecture(lecture_id)
+        if index_needed:
+            rag_solver.begin_lecture(lecture_id)
+
+        # Pages stream into the RAG index in batches while extraction continues
+        texts, batch = [], []
+        for page_number, text in iter_pdf_pages(file_path):
+            texts.append(text)
+            batch.append((page_number, text))
+            if len(batch) >= PDF_INDEX_BATCH_PAGES:
+                if index_needed: rag_solver.add_pages(batch, lecture_id)
+                batch = []
+        if batch and index_needed:
+            rag_solver.add_pages(batch, lecture_id)
+        if index_needed:
+            rag_solver.finish_lecture(lecture_id)
+
+        result = pdf_summary(texts, method, lecture_id)
+        result_cache.put("pdf_summary", summary_key, result)
+        return result
+    finally:
+        if os.path.exists(file_path): os.remove(file_path)
+
+def pdf_summary(texts, method, lecture_id):
+    """The ~35% extractive report over a PDF's page texts."""
+    all_text = "\n\n".join(texts)
+    
+    # USE THE CUSTOM 35% SUMMARIZER
+    embed_fn = rag_solver.embeddings.embed_documents if method == "textrank-embed" else None
+    with tracer.span("extractive_summary", method=method):
+        summary_text, orig_count, summary_count = accurate_35_summarize(all_text, method=method, embed_fn=embed_fn)
+    
+    # Add Header Metadata
+    final_summary = f"""# PDF Summary Report
         
 **Original Words**: {orig_count:,}
 **Summary Words**: {summary_count:,}
-**Coverage**: ~35% (TextRank Algorithm)
+**Coverage**: ~35% ({METHOD_LABELS[method]})
 
 ## Key Concepts
 
 {summary_text}
 """
-        return {
-            "summary_markdown": final_summary,
-            "original_word_count": orig_count,
-            "summary_word_count": summary_count
-        } 
+    return {
+        "summary_markdown": final_summary,
+        "original_word_count": orig_count,
+        "summary_word_count": summary_count,
+        "lecture_id": lecture_id
+    }
+
+def check_summary_method(method):
+    if method not in METHOD_LABELS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {sorted(METHOD_LABELS)}")
+
+@app.post("/pdf_summarize")
+async def pdf_summarize(file: UploadFile, method: str = Form("tfidf")):
+    check_summary_method(method)
+    file_path, digest = await run_in_threadpool(save_upload, file)
+    return await run_job("pdf_summarize", pdf_task, file_path, file.filename, method, digest)
+
+def transcribe_task(upload, digest=None, model_size="medium"):
+    """upload is a spooled path (removed when done) or the request's open upload file."""
+    print(f"🎤 Transcribing Upload with {model_size} model...")
+    try:
+        key = transcript_key(digest or file_digest(upload), model_size, language=None)
+        transcript = " ".join([s["text"] for s in transcribe_segments(upload, model_size, key, language=None)])
     finally:
-        if os.path.exists(file_path): os.remove(file_path)
+        if isinstance(upload, str) and os.path.exists(upload): os.remove(upload)
+    
+    lecture_id = f"lec_{key[:16]}"
+    if not rag_solver.has_lecture(lecture_id):
+        rag_solver.process_lecture_data(transcript, lecture_id)
+    return {"transcript": transcript, **bart_summary(transcript), "lecture_id": lecture_id}
+
+def bart_summary(transcript):
+    """{"summary": per-chunk BART summaries, "overall_summary": their reduction}, cached by transcript."""
+    summary_key = content_key(SUMMARIZER_ID, SUMMARIZER_BACKEND, transcript, SUMMARIZER_MAX_INPUT_TOKENS)
+    cached = result_cache.get("bart_summary", summary_key)
+    if cached is not None:
+        return cached
+
+    with model_manager.use("summarizer") as pipe, \
+            tracer.span("bart_summary", backend=SUMMARIZER_BACKEND, batch_size=SUMMARIZER_BATCH_SIZE) as span:
+        summary, overall = abstractive.summarize_document(
+            pipe, transcript, SUMMARIZER_MAX_INPUT_TOKENS, SUMMARIZER_BATCH_SIZE,
+            stage=lambda: job_manager.stage("llm"), max_length=150, min_length=30, do_sample=False,
+        )
+        span.update(chunks=len(summary))
+    result = {"summary": summary, "overall_summary": overall}
+    result_cache.put("bart_summary", summary_key, result)
+    return result
 
 @app.post("/transcribe_and_summarize")
 async def transcribe_and_summarize(file: UploadFile, model_size: str = Form("medium")):
-    os.makedirs("./tmp", exist_ok=True)
-    path = f"./tmp/{file.filename}"
-    with open(path, "wb") as f: shutil.copyfileobj(file.file, f)
-    
+    # The upload stays open until this handler returns, so the job reads it directly
+    return await run_job("transcribe_and_summarize", transcribe_task, file.file, None, model_size)
+
+# --------------------
+# Streaming Pipeline (SSE)
+# --------------------
+# Segments, chunk summaries and final notes are pushed to the client as
+# Server-Sent Events while the job is still transcribing.
+def stream_transcribe_task(upload, model_size="medium", emit=None):
+    return process_full_pipeline(upload, f"up_{uuid.uuid4().hex[:8]}", model_size, emit)
+
+def sse_job_response(kind, fn, *args):
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    job = admit_job(kind, fn, *args, emit=emit)
+
+    def finished(future):
+        if future.exception():
+            emit("error", {"detail": job["error"]})
+        else:
+            emit("done", future.result())
+    job["future"].add_done_callback(finished)
+
+    async def stream():
+        try:
+            yield f"event: job\ndata: {json.dumps({'job_id': job['job_id']})}\n\n"
+            while True:
+                event, data = await events.get()
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event in ("done", "error"):
+                    break
+        finally:
+            # Reached early when the client disconnects: stop the job's decoding.
+            # After "done" the flag is set on a finished job and has no effect.
+            job["cancel"].set()
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.post("/stream/transcribe")
+async def stream_transcribe(file: UploadFile, model_size: str = Form("medium")):
+    # Uploads are closed only after the streamed response finishes
+    return sse_job_response("stream_transcribe", stream_transcribe_task, file.file, model_size)
+
+@app.post("/stream/youtube")
+async def stream_youtube(item: dict):
+    return sse_job_response("stream_youtube", youtube_task, item)
+
+# Token streams: "token" events carry generated text, "done" carries the full
+# result plus ttft_ms / tokens_per_second under "stream".
+class NotesRequest(BaseModel):
+    text: str
+
+def stream_rag_query_task(item: RagQuery, emit=None):
+    stream = TokenStream(emit, job_manager.cancel_event())
+    answer = rag_solver.ask_doubt(item.question, item.lecture_id, item.lecture_ids, item.course_ids, item.scope, stream)
+    return {"answer": answer, "stream": stream.stats()}
+
+def stream_notes_task(item: NotesRequest, emit=None):
+    if not item.text.strip():
+        raise HTTPException(status_code=400, detail="Empty text provided.")
+    stream = TokenStream(emit, job_manager.cancel_event())
+    notes = generate_notes(item.text, stream)
+    return {"notes": notes, "stream": stream.stats()}
+
+@app.post("/stream/rag/query")
+async def stream_rag_query(item: RagQuery):
+    check_rag_query(item)
+    return sse_job_response("stream_rag_query", stream_rag_query_task, item)
+
+@app.post("/stream/notes")
+async def stream_notes(item: NotesRequest):
+    return sse_job_response("stream_notes", stream_notes_task, item)
+
+@app.post("/stream/generate_quiz")
+async def stream_generate_quiz(item: QuizRequest):
+    return sse_job_response("stream_quiz", quiz_task, item)
+
+# --------------------
+# Async Job API
+# --------------------
+# Submit endpoints return a job id immediately; poll /jobs/{id} for progress.
+@app.post("/jobs/youtube_summarize", status_code=202)
+async def submit_youtube_summarize(item: dict):
+    return submit_job("youtube_summarize", youtube_task, item)
+
+@app.post("/jobs/transcribe_and_summarize", status_code=202)
+async def submit_transcribe_and_summarize(file: UploadFile, model_size: str = Form("medium")):
+    # Spooled before submitting: the upload is closed once this response is sent
+    file_path, digest = await run_in_threadpool(save_upload, file)
     try:
-        print(f"🎤 Transcribing Upload with {model_size} model...")
-        model = get_whisper_model(model_size)
-        segments, _ = model.transcribe(path, beam_size=5)
-        transcript = " ".join([s.text for s in segments])
-        
-        rag_solver.process_lecture_data(transcript)
-        
-        chunks = [transcript[i:i+3000] for i in range(0, len(transcript), 3000)]
-        summary = []
-        for ch in chunks:
-            if len(ch.split()) > 50:
-                s = summarizer(ch, max_length=150, min_length=30, do_sample=False)
-                summary.append(s[0]['summary_text'])
-        return {"transcript": transcript, "summary": summary}
+        return submit_job("transcribe_and_summarize", transcribe_task, file_path, digest, model_size)
+    except HTTPException:
+        os.remove(file_path)
+        raise
+
+@app.post("/jobs/pdf_summarize", status_code=202)
+async def submit_pdf_summarize(file: UploadFile, method: str = Form("tfidf")):
+    check_summary_method(method)
+    file_path, digest = await run_in_threadpool(save_upload, file)
+    try:
+        return submit_job("pdf_summarize", pdf_task, file_path, file.filename, method, digest)
+    except HTTPException:
+        if os.path.exists(file_path): os.remove(file_path)
+        raise
+
+@app.post("/jobs/generate_quiz", status_code=202)
+async def submit_generate_quiz(item: QuizRequest):
+    return submit_job("generate_quiz", quiz_task, item)
+
+@app.post("/jobs/generate_mindmap", status_code=202)
+async def submit_generate_mindmap(item: MindMapRequest):
+    check_mindmap(item)
+    return submit_job("generate_mindmap", mindmap_task, item)
+
+@app.post("/jobs/rag/query", status_code=202)
+async def submit_rag_query(item: RagQuery):
+    check_rag_query(item)
+    return submit_job("rag_query", rag_query_task, item)
+
+@app.get("/jobs")
+async def jobs_overview():
+    return job_manager.stats()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = job_manager.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown job id.")
+    return job_manager.describe(job)
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = job_manager.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown job id.")
+    if job["status"] in ("failed", "cancelled"):
+        raise HTTPException(status_code=job["status_code"] or 500, detail=job["error"])
+    if job["status"] != "done":
+        return JSONResponse(status_code=202, content=job_manager.describe(job))
+    return job["result"]
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/health")
+async def health():
+    stats = job_manager.stats()
+    return {"status": "ok", "queued": stats["queued"], "running": stats["running"]}
+
+# --------------------
+# Bulk API (course onboarding)
+# --------------------
+# One job per batch; every item's result is pushed as an "item" SSE event as
+# soon as it is ready and "done" carries them all. Ingest extracts texts in
+# parallel and embeds each wave of up to BULK_EMBED_CHUNKS new chunks in one
+# batched pass before the per-lecture indexes are written (the library index,
+# if asked for, is rebuilt once at the end). Quiz and mind-map prompts are
+# decoded LLM_MAX_BATCH at a time in one lockstep constrained batch.
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "64"))
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))
+BULK_EMBED_CHUNKS = int(os.getenv("BULK_EMBED_CHUNKS", "2048"))
+
+class BulkQuizRequest(BaseModel):
+    items: List[QuizRequest]
+
+class BulkMindMapRequest(BaseModel):
+    items: List[MindMapRequest]
+
+def check_bulk(n):
+    if not n:
+        raise HTTPException(status_code=400, detail="No items provided.")
+    if n > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} items per bulk request.")
+
+def error_detail(e):
+    return e.detail if isinstance(e, HTTPException) else str(e)
+
+class BulkResults:
+    """Collects per-item results, emitting each one and the job progress as it lands."""
+    def __init__(self, kind, labels, emit=None):
+        self.kind = kind
+        self.labels = labels
+        self.items = [None] * len(labels)
+        self.emit = emit or (lambda event, data: None)
+        self.report = job_manager.reporter()
+        self.start = time.perf_counter()
+
+    def put(self, i, result):
+        self.items[i] = {"index": i, "name": self.labels[i], **result}
+        self.emit("item", self.items[i])
+        self.report(stage=self.kind, done=sum(r is not None for r in self.items), total=len(self.items))
+
+    def fail(self, i, e):
+        print(f"   ❌ {self.kind} item {i} ({self.labels[i]}) failed: {error_detail(e)}")
+        self.put(i, {"error": error_detail(e)})
+
+    def summary(self, **extra):
+        failed = sum(1 for r in self.items if "error" in r)
+        return {
+            "items": self.items,
+            "succeeded": len(self.items) - failed,
+            "failed": failed,
+            "seconds": round(time.perf_counter() - self.start, 2),
+            **extra,
+        }
+
+def bulk_extract(upload, method, model_size, course_id, cancel):
+    """Text and chunks of one upload, or its finished result when cached."""
+    path, digest, filename = upload
+    try:
+        if cancel.is_set():
+            raise JobCancelled("Client disconnected; bulk ingest stopped.")
+        if (filename or "").lower().endswith(".pdf"):
+            summary_key = content_key(digest, method)
+            lecture_id = f"pdf_{digest[:16]}"
+            cached = result_cache.get("pdf_summary", summary_key)
+            if cached is not None and rag_solver.has_lecture(lecture_id):
+                return {"result": cached}
+            pages = list(iter_pdf_pages(path))
+
+            def finish():
+                result = pdf_summary([text for _, text in pages], method, lecture_id)
+                result_cache.put("pdf_summary", summary_key, result)
+                return result
+            return {
+                "lecture_id": lecture_id,
+                "docs": rag_solver.split_pages(pages, lecture_id, course_id=course_id),
+                "finish": finish,
+            }
+
+        key = transcript_key(digest, model_size, language=None)
+        transcript = " ".join(s["text"] for s in transcribe_segments(path, model_size, key, language=None))
+        lecture_id = f"lec_{key[:16]}"
+        return {
+            "lecture_id": lecture_id,
+            "docs": rag_solver.split(transcript, lecture_id, course_id=course_id),
+            "finish": lambda: {"transcript": transcript, **bart_summary(transcript), "lecture_id": lecture_id},
+        }
     finally:
         if os.path.exists(path): os.remove(path)
 
+def bulk_ingest_task(uploads, method="tfidf", model_size="medium", course_id=None, build_library=False, emit=None):
+    cancel = job_manager.cancel_event()
+    results = BulkResults("ingest", [name for _, _, name in uploads], emit)
+    wave = []
+
+    def flush():
+        texts = [d.page_content for _, item in wave for d in item["docs"]]
+        if texts:
+            # Fills the vector cache in full batches; the index writes below are all hits
+            with tracer.span("bulk_embed", chunks=len(texts), items=len(wave)):
+                rag_solver.embeddings.embed_documents(texts)
+        for i, item in wave:
+            try:
+                rag_solver.index_docs(item["docs"], item["lecture_id"])
+                results.put(i, item["finish"]())
+            except Exception as e:
+                results.fail(i, e)
+        wave.clear()
+
+    pool = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix="bulk")
+    try:
+        futures = {pool.submit(bulk_extract, u, method, model_size, course_id, cancel): i for i, u in enumerate(uploads)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                item = future.result()
+            except JobCancelled:
+                raise
+            except Exception as e:
+                results.fail(i, e)
+                continue
+            if "result" in item:
+                results.put(i, item["result"])
+                continue
+            wave.append((i, item))
+            if sum(len(item["docs"]) for _, item in wave) >= BULK_EMBED_CHUNKS:
+                flush()
+        flush()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    library = rag_solver.library.build() if build_library else None
+    return results.summary(library=library)
+
+def bulk_quiz_task(item: BulkQuizRequest, emit=None):
+    cancel = job_manager.cancel_event()
+    results = BulkResults("quiz", [f"quiz {i}" for i in range(len(item.items))], emit)
+    pending = []
+    for i, q in enumerate(item.items):
+        if not q.note_content.strip():
+            results.put(i, {"error": "Note content is empty."})
+            continue
+        messages = quiz_messages(q)
+        cached = result_cache.get("quiz", content_key(LLM_ID, messages))
+        if cached is not None:
+            results.put(i, {"quiz": cached})
+        else:
+            pending.append((i, q, messages))
+
+    print(f"🧠 Generating {len(pending)} quizzes in batches of {LLM_MAX_BATCH}...")
+    decoded = generate_structured_many(
+        [m for _, _, m in pending], [structured.quiz_program(q.num_questions) for _, q, _ in pending], 0.3, cancel,
+    )
+    for position, quiz_data in decoded:
+        i, _, messages = pending[position]
+        final_quiz = format_quiz(quiz_data)
+        if final_quiz:
+            result_cache.put("quiz", content_key(LLM_ID, messages), final_quiz)
+        results.put(i, {"quiz": final_quiz})
+    return results.summary()
+
+def bulk_mindmap_task(item: BulkMindMapRequest, emit=None):
+    cancel = job_manager.cancel_event()
+    results = BulkResults("mindmap", [f"mindmap {i}" for i in range(len(item.items))], emit)
+    pending = []
+
+    def finish(i, dot_code):
+        image_url = render_service.render_sync(dot_code, item.items[i].format) if dot_code else None
+        if image_url:
+            results.put(i, {"image_url": image_url})
+        else:
+            results.put(i, {"error": "Failed to generate mind map."})
+
+    for i, m in enumerate(item.items):
+        try:
+            check_mindmap(m)
+        except HTTPException as e:
+            results.fail(i, e)
+            continue
+        messages = dot_messages(m.note_content)
+        cached = result_cache.get("dot", content_key(LLM_ID, "dot", messages))
+        if cached is not None:
+            finish(i, cached)
+        else:
+            pending.append((i, messages))
+
+    print(f"🎨 Generating {len(pending)} diagrams in batches of {LLM_MAX_BATCH}...")
+    decoded = generate_structured_many(
+        [m for _, m in pending], [structured.dot_program(DOT_HEADER) for _ in pending], 0.2, cancel,
+    )
+    for position, dot_code in decoded:
+        i, messages = pending[position]
+        result_cache.put("dot", content_key(LLM_ID, "dot", messages), dot_code)
+        finish(i, dot_code)
+    return results.summary()
+
+@app.post("/bulk/ingest")
+async def bulk_ingest(
+    files: List[UploadFile],
+    method: str = Form("tfidf"),
+    model_size: str = Form("medium"),
+    course_id: Optional[str] = Form(None),
+    build_library: bool = Form(False),
+):
+    """PDFs and recordings in one job; each is summarized and indexed as its own lecture."""
+    check_summary_method(method)
+    check_bulk(len(files))
+    # Spilled to private files: the uploads close once the response starts
+    uploads = []
+    for file in files:
+        path, digest = await run_in_threadpool(save_upload, file)
+        uploads.append((path, digest, file.filename))
+    try:
+        return sse_job_response("bulk_ingest", bulk_ingest_task, uploads, method, model_size, course_id, build_library)
+    except HTTPException:
+        for path, _, _ in uploads:
+            if os.path.exists(path): os.remove(path)
+        raise
+
+@app.post("/bulk/generate_quiz")
+async def bulk_generate_quiz(item: BulkQuizRequest):
+    check_bulk(len(item.items))
+    return sse_job_response("bulk_quiz", bulk_quiz_task, item)
+
+@app.post("/bulk/generate_mindmap")
+async def bulk_generate_mindmap(item: BulkMindMapRequest):
+    check_bulk(len(item.items))
+    return sse_job_response("bulk_mindmap", bulk_mindmap_task, item)
+
+# --------------------
+# Live Transcription: Rolling Buffer + Local Agreement
+# --------------------
+# Each session keeps a short in-memory PCM buffer. Words that two consecutive
+# decodes agree on are committed and the buffer is trimmed behind them, so the
+# cost per chunk stays flat no matter how long the session runs.
+LIVE_WORKERS = int(os.getenv("LIVE_WORKERS", "4"))
+LIVE_TRIM_SECONDS = float(os.getenv("LIVE_TRIM_SECONDS", "8"))
+LIVE_MAX_BUFFER_SECONDS = float(os.getenv("LIVE_MAX_BUFFER_SECONDS", "20"))
+
+live_executor = ThreadPoolExecutor(max_workers=LIVE_WORKERS, thread_name_prefix="live")
+
+def decode_audio_bytes(data, fmt="webm"):
+    """Decodes a compressed blob (or raw s16le PCM) to 16 kHz mono float32 in memory."""
+    if fmt == "pcm16":
+        return np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+    return decode_audio(io.BytesIO(data), sampling_rate=SAMPLE_RATE)
+
+def normalize_word(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+class LiveTranscriber:
+    def __init__(self, model, language="en"):
+        self.model = model
+        self.language = language
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0
+        self.committed = []
+        self.hypothesis = []
+
+    def insert(self, pcm):
+        self.audio = np.concatenate([self.audio, pcm])
+
+    def committed_end(self):
+        return self.committed[-1][1] if self.committed else self.offset
+
+    def _trim(self, until):
+        cut = int(max(0.0, until - self.offset) * SAMPLE_RATE)
+        self.audio = self.audio[cut:]
+        self.offset += cut / SAMPLE_RATE
+
+    def process(self):
+        """Decodes the buffer once; returns (newly committed text, interim text)."""
+        prompt = "".join(w for *_, w in self.committed[-50:]).strip()
+        segments, _ = self.model.transcribe(
+            self.audio,
+            beam_size=1,
+            language=self.language,
+            word_timestamps=True,
+            condition_on_previous_text=False,
+            initial_prompt=prompt or None,
+        )
+        boundary = self.committed_end() - 0.05
+        words = [
+            (self.offset + w.start, self.offset + w.end, w.word)
+            for s in segments for w in (s.words or [])
+            if self.offset + w.start >= boundary
+        ]
+
+        # LocalAgreement-2: commit the prefix shared with the previous hypothesis
+        stable = []
+        for new, old in zip(words, self.hypothesis):
+            if normalize_word(new[2]) != normalize_word(old[2]):
+                break
+            stable.append(new)
+        self.hypothesis = words[len(stable):]
+
+        buffered = len(self.audio) / SAMPLE_RATE
+        overflow = buffered > LIVE_MAX_BUFFER_SECONDS
+        if overflow:
+            # Nothing has stabilised for too long: accept the current hypothesis
+            stable.extend(self.hypothesis)
+            self.hypothesis = []
+
+        self.committed.extend(stable)
+        if overflow:
+            # Keep only the last second so a half-spoken word survives
+            self._trim(max(self.committed_end(), self.offset + buffered - 1.0))
+        elif stable and buffered > LIVE_TRIM_SECONDS:
+            self._trim(self.committed_end())
+
+        commit_text = "".join(w for *_, w in stable).strip()
+        interim_text = "".join(w for *_, w in self.hypothesis).strip()
+        return commit_text, interim_text
+
+    def flush(self):
+        text = "".join(w for *_, w in self.hypothesis).strip()
+        self.committed.extend(self.hypothesis)
+        self.hypothesis = []
+        return text
+
 @app.websocket("/ws/live_transcribe")
-async def websocket_endpoint(websocket: WebSocket, model_size: str = "small"):
+async def websocket_endpoint(websocket: WebSocket, model_size: str = "small", audio_format: str = "webm", mode: str = "text"):
+    """mode=text sends committed text only; mode=json also sends interim hypotheses."""
     await websocket.accept()
     print(f"🔌 Live connection started. Using model: {model_size}")
-    
-    model = get_whisper_model(model_size)
-    last_audio_bytes = b""
-    
+
+    loop = asyncio.get_running_loop()
+    # Pinned for the whole session so eviction cannot force a second copy to load
+    model_name = whisper_key(model_size)
+    model = await loop.run_in_executor(live_executor, model_manager.acquire, model_name)
+    session = LiveTranscriber(model)
+    incoming = asyncio.Queue()
+
+    async def send(kind, text):
+        if not text:
+            return
+        if mode == "json":
+            await websocket.send_json({"type": kind, "text": text})
+        elif kind == "commit":
+            await websocket.send_text(text)
+
+    async def receive():
+        try:
+            while True:
+                incoming.put_nowait(await websocket.receive_bytes())
+        except Exception:
+            pass
+        finally:
+            incoming.put_nowait(None)
+
+    receiver = asyncio.create_task(receive())
     try:
         while True:
-            new_bytes = await websocket.receive_bytes()
-            combined = last_audio_bytes + new_bytes
-            last_audio_bytes = new_bytes
-            
-            with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
-                tmp.write(combined)
-                tmp_path = tmp.name
-            
-            try:
-                segments, _ = model.transcribe(tmp_path, beam_size=1)
-                text = " ".join([s.text for s in segments]).strip()
-                if text: await websocket.send_text(text)
-            finally:
-                if os.path.exists(tmp_path): os.remove(tmp_path)
-    except Exception:
-        await websocket.close()
\ No newline at end of file
+            # Fold every blob that arrived during the last decode into one pass
+            blobs = [await incoming.get()]
+            while not incoming.empty():
+                blobs.append(incoming.get_nowait())
+            closed = blobs[-1] is None
+            for data in (b for b in blobs if b is not None):
+                try:
+                    session.insert(await loop.run_in_executor(live_executor, decode_audio_bytes, data, audio_format))
+                except Exception as e:
+                    print(f"   ⚠️ Skipping undecodable live chunk: {e}")
+            if closed:
+                break
+            if len(session.audio) == 0:
+                continue
+
+            commit_text, interim_text = await loop.run_in_executor(live_executor, session.process)
+            await send("commit", commit_text)
+            await send("interim", interim_text)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ Live session error: {e}")
+    finally:
+        receiver.cancel()
+        model_manager.release(model_name)
+        try:
+            await send("commit", session.flush())
+            await websocket.close()
+        except Exception:
+            pass
@@ -29,10 +29,22 @@ export async function mlFetch(path: string, options?: RequestInit) {
   });
 }
 
-export const askDoubt = async (question: string) => {
+// Indexes a note as its own lecture; pass the returned id back to re-index the same note
+export const ingestNote = async (text: string, lectureId?: string | null) => {
+  const response = await mlFetch("/rag/ingest", {
+    method: "POST",
+    body: JSON.stringify({ text, lecture_id: lectureId ?? null }),
+  });
+
+  if (!response.ok) throw new Error("Failed to index note");
+  const data = await response.json();
+  return data.lecture_id as string;
+};
+
+export const askDoubt = async (question: string, lectureId: string) => {
   const response = await mlFetch("/rag/query", {
     method: "POST",
-    body: JSON.stringify({ question }),
+    body: JSON.stringify({ question, lecture_id: lectureId }),
   });
 
   if (!response.ok) throw new Error("Failed to ask doubt");
@@ -1,11 +1,11 @@
 "use client";
 
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useNote } from "@/app/contexts/NotesContext"; 
 import { Send, Bot, User, Loader2, ChevronDown, ChevronUp, RefreshCw } from "lucide-react";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
-import { askDoubt } from "@/app/lib/api";
+import { askDoubt, ingestNote } from "@/app/lib/api";
 
 interface Message {
   role: "user" | "ai";
@@ -21,6 +21,8 @@ export function RagDoubtSolver() {
   // Default to collapsed so it doesn't block view initially
   const [isMinimized, setIsMinimized] = useState(true);
   const [isIndexing, setIsIndexing] = useState(false); 
+  // The backend indexes this note under its own lecture id; questions go to that id only
+  const lectureId = useRef<string | null>(null);
 
   const extractTextFromBlocks = (jsonString: string) => {
     try {
@@ -48,11 +50,7 @@ export function RagDoubtSolver() {
 
       setIsIndexing(true);
       try {
-        await fetch(`${process.env.NEXT_PUBLIC_ML_API_URL}rag/ingest`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ text: plainText }),
-        });
+        lectureId.current = await ingestNote(plainText, lectureId.current);
         console.log("✅ AI context updated with current note.");
       } catch (err) {
         console.error("Failed to index note:", err);
@@ -74,10 +72,17 @@ export function RagDoubtSolver() {
     const userMessage: Message = { role: "user", content: query };
     setMessages((prev) => [...prev, userMessage]);
     setQuery("");
+    if (!lectureId.current) {
+      setMessages((prev) => [
+        ...prev,
+        { role: "ai", content: "⏳ I'm still reading your note. Please ask again in a moment." },
+      ]);
+      return;
+    }
     setIsLoading(true);
 
     try {
-      const answer = await askDoubt(userMessage.content);
+      const answer = await askDoubt(userMessage.content, lectureId.current);
       const aiMessage: Message = { role: "ai", content: answer };
       setMessages((prev) => [...prev, aiMessage]);
     } catch (error) {